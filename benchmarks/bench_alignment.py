@@ -0,0 +1,88 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# Micro-benchmark of the delimiter alignment: the previous split on bare <span> markers against
+# numbered spans decoded and validated in one pass. A second run corrupts translated documents at
+# random (dropped, merged, duplicated and reordered spans) and checks that every caption comes back
+# in place after the misaligned captions are re-requested from an identity translator.
+# Usage: python benchmarks/bench_alignment.py [cueCount] [corruptedDocuments]
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "translate_captions"))
+
+from caption_alignment import CaptionAlignmentError, encodeCaptions, alignCaptions, splitCaptions
+
+LEGACY_DELIMITER = "<span>"
+
+
+def legacyAlign(document, count):
+    entries = document.split(LEGACY_DELIMITER)
+    return [entries[i] for i in range(count)]
+
+
+def numberedAlign(document, count):
+    expected = list(range(count))
+    captions, misaligned = alignCaptions(document, expected)
+    if misaligned:
+        raise CaptionAlignmentError("misaligned")
+    return [captions[i] for i in expected]
+
+
+# Damage up to five spans, each in its own segment of the document so the errors are independent
+def corrupt(document, rng):
+    spans = splitCaptions(document)
+    damages = rng.randint(1, 5)
+    segment = len(spans) // damages
+    for position in reversed([rng.randrange(segment * i, segment * (i + 1) - 1) for i in range(damages)]):
+        damage = rng.choice(("drop", "merge", "duplicate", "reorder"))
+        if damage == "drop":
+            del spans[position]
+        elif damage == "merge":
+            merged = re.sub(r"</span><span[^>]*>", " ", spans[position] + spans[position + 1])
+            spans[position:position + 2] = [merged]
+        elif damage == "duplicate":
+            spans.insert(position, spans[position])
+        else:
+            spans[position], spans[position + 1] = spans[position + 1], spans[position]
+    return "".join(spans)
+
+
+def measure(label, cueCount, function, *arguments):
+    started = time.perf_counter()
+    function(*arguments)
+    elapsed = time.perf_counter() - started
+    print("{:<20} {:>8.3f}s {:>12.0f} cues/s".format(label, elapsed, cueCount / elapsed))
+
+
+def main():
+    cueCount = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    documents = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    texts = ["Caption number {} of the benchmark track".format(i) for i in range(cueCount)]
+
+    print("{} cues".format(cueCount))
+    measure("legacy split", cueCount, legacyAlign, LEGACY_DELIMITER.join(texts), cueCount)
+    measure("numbered spans", cueCount, numberedAlign, encodeCaptions(enumerate(texts)), cueCount)
+
+    rng = random.Random(0)
+    sample = texts[:500]
+    document = encodeCaptions(enumerate(sample))
+    expected = list(range(len(sample)))
+    requested = 0
+    for _ in range(documents):
+        captions, misaligned = alignCaptions(corrupt(document, rng), expected)
+        requested += len(misaligned)
+        captions.update((i, sample[i]) for i in misaligned)
+        # a merged span leaves the text of the dropped caption in a neighbour, which must be re-requested too
+        if [captions[i] for i in expected] != sample:
+            raise AssertionError("caption misplaced after recovery")
+    print("{} corrupted documents of {} cues recovered, {:.1f} captions re-requested per document".format(
+        documents, len(sample), float(requested) / documents))
+
+
+if __name__ == "__main__":
+    main()
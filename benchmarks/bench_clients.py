@@ -0,0 +1,62 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# Per-file latency of the S3 operations done for one caption file (read, write, rename) with the
+# cached AwsHelper clients against building a new client for every operation.
+# Runs against moto, no AWS account is needed: pip install boto3 moto
+# Usage: python benchmarks/bench_clients.py [fileCount]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "translate_captions"))
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+import boto3
+from moto import mock_aws
+
+import helper
+from helper import S3Helper
+
+BUCKET = "bench-captions"
+
+
+# Previous behaviour: every S3Helper call built a new client
+class UncachedAwsHelper(helper.AwsHelper):
+    def getClient(self, name, awsRegion=None, maxPoolConnections=None):
+        return boto3.client(name, config=self.getConfig(maxPoolConnections))
+
+
+def processFiles(fileCount, body):
+    started = time.perf_counter()
+    for i in range(fileCount):
+        key = "input/file{}.vtt".format(i)
+        S3Helper.writeToS3(body, BUCKET, key)
+        S3Helper.readFromS3(BUCKET, key)
+        S3Helper.writeToS3(body, BUCKET, "captions-in/file{}.vtt.delimited".format(i))
+        S3Helper.renameObject(BUCKET, key, key + ".processed")
+    return (time.perf_counter() - started) / fileCount
+
+
+def main():
+    fileCount = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "vttsample.vtt")) as f:
+        body = f.read()
+    with mock_aws():
+        boto3.client("s3").create_bucket(Bucket=BUCKET)
+        cachedHelper = helper.AwsHelper
+        helper.AwsHelper = UncachedAwsHelper
+        uncached = processFiles(fileCount, body)
+        helper.AwsHelper = cachedHelper
+        cached = processFiles(fileCount, body)
+    print("{} files".format(fileCount))
+    print("new client per call   {:8.2f} ms/file".format(uncached * 1000))
+    print("cached pooled client  {:8.2f} ms/file".format(cached * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# Compares the streaming caption parser against the previous webvtt-py path on a large synthetic file.
+# Usage: python benchmarks/bench_parser.py [cueCount]
+
+import io
+import os
+import sys
+import time
+import tracemalloc
+from tempfile import NamedTemporaryFile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "translate_captions"))
+
+from caption_parser import iterSRTCues, iterVTTCues
+
+
+def timestamp(millis, separator):
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    seconds, millis = divmod(millis, 1000)
+    return "{:02d}:{:02d}:{:02d}{}{:03d}".format(hours, minutes, seconds, separator, millis)
+
+
+def generateCaptions(cueCount, captionFormat):
+    separator = "," if captionFormat == "srt" else "."
+    lines = ["WEBVTT", ""] if captionFormat == "vtt" else []
+    for i in range(cueCount):
+        if captionFormat == "srt":
+            lines.append(str(i + 1))
+        lines.append(timestamp(i * 2000, separator) + " --> " + timestamp(i * 2000 + 1900, separator))
+        lines.append("Caption line number {} for the benchmark".format(i))
+        lines.append("with a second line of text")
+        lines.append("")
+    return "\r\n".join(lines).encode("utf-8")
+
+
+# Timing and peak memory are taken in separate runs, tracemalloc slows the parse down considerably
+def measure(label, function):
+    started = time.perf_counter()
+    count = function()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("{:<28} {:>8} cues {:>8.3f}s {:>12.0f} cues/s  peak {:>8.1f} MB".format(
+        label, count, elapsed, count / elapsed, peak / (1024 * 1024)))
+
+
+def streamingParse(data, captionFormat):
+    parse = iterSRTCues if captionFormat == "srt" else iterVTTCues
+    return sum(1 for _ in parse(io.BytesIO(data)))
+
+
+def webvttParse(data, captionFormat):
+    import webvtt
+    text = data.decode("utf-8")
+    if captionFormat == "vtt":
+        return len(list(webvtt.read_buffer(io.StringIO(text))))
+    f = NamedTemporaryFile(mode="w+", delete=False)
+    try:
+        f.write(text)
+        f.close()
+        return len(list(webvtt.from_srt(f.name)))
+    finally:
+        os.unlink(f.name)
+
+
+def main():
+    cueCount = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    try:
+        import webvtt  # noqa: F401
+        haveWebvtt = True
+    except ImportError:
+        haveWebvtt = False
+        print("webvtt-py is not installed, only the streaming parser is measured")
+
+    for captionFormat in ("srt", "vtt"):
+        data = generateCaptions(cueCount, captionFormat)
+        print("{} input: {:.1f} MB".format(captionFormat.upper(), len(data) / (1024 * 1024)))
+        measure("streaming parser", lambda: streamingParse(data, captionFormat))
+        if haveWebvtt:
+            measure("webvtt-py", lambda: webvttParse(data, captionFormat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,523 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# End-to-end benchmark of both Lambda functions without an AWS account. A synthetic corpus of SRT and VTT
+# files is uploaded to an in-memory S3 (or moto), s3_event_handler.lambda_handler converts it and starts the
+# batch jobs on a fake Amazon Translate that echoes or pseudo-translates the documents, then
+# translate_job_event_handler.lambda_handler rebuilds the translated files as each job completes.
+# Reports the wall time of every stage, the time spent in parse, delimit, align, reassembly and
+# serialization summed over the worker threads, the S3 calls per operation and the peak RSS.
+# Usage: python benchmarks/bench_pipeline.py [--files N] [--cues M] [--targets es,fr] [--s3 memory|moto] ...
+# The moto backend needs: pip install moto
+
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from fnmatch import fnmatch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "translate_captions"))
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+from botocore.exceptions import ClientError
+
+import captions_helper
+import helper
+import s3_event_handler
+import translate_job_event_handler
+from captions_helper import Captions
+from caption_translators import pseudoTranslator
+
+BUCKET = "bench-captions"
+ACCOUNT_ID = "123456789012"
+FUNCTION_ARN = "arn:aws:lambda:us-east-1:{}:function:bench-captions".format(ACCOUNT_ID)
+TRIGGER_FILE = "start"
+
+WORDS = ("the", "train", "was", "late", "again", "but", "nobody", "seemed", "to", "notice", "it", "we", "waited",
+         "on", "platform", "nine", "for", "an", "hour", "and", "then", "walked", "home", "translation", "service",
+         "delivers", "fast", "affordable", "language", "Amazon", "Translate", "neural", "machine")
+
+# Captions methods timed per stage, summed over the worker threads. Realtime translation includes the
+# reassembly of the short files it translates.
+TIMED_STAGES = (
+    ("parse", ("vttToCaptions", "srtToCaptions")),
+    ("delimit", ("SegmentCaptions", "ConvertToDemilitedFiles", "ShardDelimitedFile")),
+    ("realtime translate", ("TranslateCaptionsRealtime",)),
+    ("align", ("AlignTranslatedCaptions",)),
+    ("reassemble", ("ApplyTranslatedCaptions",)),
+    ("reflow", ("ReflowCaptions",)),
+    ("serialize", ("captionsToVTT", "captionsToSRT")),
+)
+
+
+def timestamp(millis, separator):
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    seconds, millis = divmod(millis, 1000)
+    return "{:02d}:{:02d}:{:02d}{}{:03d}".format(hours, minutes, seconds, separator, millis)
+
+
+# A caption file shaped like vttsample.vtt / srtsample.srt: sentences running over several cues
+# markup is the fraction of cues with inline tags, VTT cues with tags also get a voice tag and cue settings
+def generateCaptions(cueCount, captionFormat, rng, markup=0.0):
+    separator = "," if captionFormat == "srt" else "."
+    lines = ["WEBVTT", ""] if captionFormat == "vtt" else []
+    position = 500
+    for i in range(cueCount):
+        duration = rng.randint(1500, 6500)
+        if captionFormat == "srt":
+            lines.append(str(i + 1))
+        timing = timestamp(position, separator) + " --> " + timestamp(position + duration, separator)
+        words = [rng.choice(WORDS) for _ in range(rng.randint(4, 14))]
+        if rng.random() < 0.3:
+            words[-1] += "."
+        if markup and rng.random() < markup:
+            first = rng.randrange(len(words))
+            last = rng.randrange(first, len(words))
+            words[first] = "<i>" + words[first]
+            words[last] += "</i>"
+            if captionFormat == "vtt":
+                timing += " align:start line:10%"
+                words[0] = "<v Speaker>" + words[0]
+                words[-1] += "</v>"
+        lines.append(timing)
+        lines.append(" ".join(words))
+        lines.append("")
+        position += duration + rng.choice((0, 0, 0, 400, 2000))
+    return "\n".join(lines).encode("utf-8")
+
+
+def generateCorpus(fileCount, cueCount, captionFormat, seed, markup=0.0):
+    rng = random.Random(seed)
+    corpus = {}
+    for i in range(fileCount):
+        fileFormat = captionFormat if captionFormat != "mixed" else ("vtt", "srt")[i % 2]
+        corpus["input/file{:05d}.{}".format(i, fileFormat)] = generateCaptions(cueCount, fileFormat, rng, markup)
+    return corpus
+
+
+# Pseudo translation of a document (see caption_translators), or the document as it is with the echo translator
+def translateDocument(document, translator):
+    if translator == "echo":
+        return document
+    return pseudoTranslator(document, None, None)
+
+
+def notFound(operation, key):
+    return ClientError({"Error": {"Code": "NoSuchKey", "Message": "The specified key does not exist: {}".format(key)}}, operation)
+
+
+# S3 client stand-in holding the objects of one bucket in memory, with the calls the handlers use
+class InMemoryS3:
+
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, IfNoneMatch=None, **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        elif not isinstance(Body, bytes):
+            Body = Body.read()
+        with self.lock:
+            if IfNoneMatch == "*" and Key in self.objects:
+                raise ClientError({"Error": {"Code": "PreconditionFailed", "Message": "At least one of the pre-conditions you specified did not hold"}}, "PutObject")
+            self.objects[Key] = Body
+        return {}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        return {"ContentLength": len(self.objects[Key])}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        body = self.objects.get(Key)
+        if body is None:
+            raise notFound("GetObject", Key)
+        return {"Body": io.BytesIO(body), "ContentLength": len(body)}
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=None, MaxKeys=1000, StartAfter=None, ContinuationToken=None):
+        after = ContinuationToken or StartAfter or ""
+        with self.lock:
+            keys = sorted(key for key in self.objects if key.startswith(Prefix) and key > after)
+        if Delimiter:
+            keys = [key for key in keys if Delimiter not in key[len(Prefix):]]
+        page = keys[:MaxKeys]
+        response = {"IsTruncated": len(keys) > MaxKeys, "KeyCount": len(page),
+                    "Contents": [{"Key": key, "Size": len(self.objects.get(key, b""))} for key in page]}
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = page[-1]
+        return response
+
+    def delete_object(self, Bucket, Key):
+        with self.lock:
+            self.objects.pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        with self.lock:
+            for entry in Delete["Objects"]:
+                self.objects.pop(entry["Key"], None)
+        return {}
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self.copy(CopySource, Bucket, Key)
+        return {}
+
+    def copy(self, CopySource, Bucket, Key, **kwargs):
+        with self.lock:
+            body = self.objects.get(CopySource["Key"])
+            if body is None:
+                raise notFound("CopyObject", CopySource["Key"])
+            self.objects[Key] = body
+
+    def get_bucket_location(self, Bucket):
+        return {"LocationConstraint": None}
+
+
+# Counts and times the calls made through a client, per operation
+class CountingClient:
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self.lock:
+                    self.calls[name] += 1
+                    self.seconds[name] += elapsed
+        return call
+
+    def reset(self):
+        with self.lock:
+            calls, seconds = dict(self.calls), dict(self.seconds)
+            self.calls.clear()
+            self.seconds.clear()
+        return calls, seconds
+
+
+# Amazon Translate stand-in. Batch jobs stay SUBMITTED until runJob writes their output the way the service
+# does, under <output>/<account>-TranslateText-<job id>/<language>.<input file>.
+class FakeTranslate:
+
+    def __init__(self, s3client, translator, jobLimit=0):
+        self.s3client = s3client
+        self.translator = translator
+        self.jobLimit = jobLimit
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.characters = 0
+
+    def start_text_translation_job(self, JobName, InputDataConfig, OutputDataConfig, SourceLanguageCode, TargetLanguageCodes, **kwargs):
+        with self.lock:
+            if self.jobLimit and len(self.pendingJobs()) >= self.jobLimit:
+                raise ClientError({"Error": {"Code": "LimitExceededException", "Message": "Too many concurrent jobs"}}, "StartTextTranslationJob")
+            jobId = "{:032x}".format(len(self.jobs) + 1)
+            self.jobs[jobId] = {
+                "JobId": jobId,
+                "JobName": JobName,
+                "JobStatus": "SUBMITTED",
+                "InputDataConfig": dict(InputDataConfig),
+                "OutputDataConfig": {"S3Uri": "{}{}-TranslateText-{}/".format(OutputDataConfig["S3Uri"], ACCOUNT_ID, jobId)},
+                "SourceLanguageCode": SourceLanguageCode,
+                "TargetLanguageCodes": list(TargetLanguageCodes),
+                "SubmittedTime": datetime.now(timezone.utc),
+            }
+        return {"JobId": jobId, "JobStatus": "SUBMITTED"}
+
+    def describe_text_translation_job(self, JobId):
+        return {"TextTranslationJobProperties": dict(self.jobs[JobId])}
+
+    def list_text_translation_jobs(self, Filter=None, NextToken=None, **kwargs):
+        status = (Filter or {}).get("JobStatus")
+        with self.lock:
+            jobs = [dict(job) for job in self.jobs.values() if status is None or job["JobStatus"] == status]
+        return {"TextTranslationJobPropertiesList": jobs}
+
+    def translate_text(self, Text, SourceLanguageCode, TargetLanguageCode, **kwargs):
+        with self.lock:
+            self.characters += len(Text)
+        return {"TranslatedText": translateDocument(Text, self.translator), "SourceLanguageCode": SourceLanguageCode,
+                "TargetLanguageCode": TargetLanguageCode}
+
+    def pendingJobs(self):
+        return [jobId for jobId, job in self.jobs.items() if job["JobStatus"] == "SUBMITTED"]
+
+    def runJob(self, jobId):
+        job = self.jobs[jobId]
+        inputPrefix = job["InputDataConfig"]["S3Uri"].split("/", 3)[3]
+        outputPrefix = job["OutputDataConfig"]["S3Uri"].split("/", 3)[3]
+        listing = self.s3client.list_objects_v2(Bucket=BUCKET, Prefix=inputPrefix, MaxKeys=1000000)
+        for entry in listing.get("Contents", []):
+            document = self.s3client.get_object(Bucket=BUCKET, Key=entry["Key"])["Body"].read().decode("utf-8")
+            with self.lock:
+                self.characters += len(document) * len(job["TargetLanguageCodes"])
+            for languageCode in job["TargetLanguageCodes"]:
+                self.s3client.put_object(Bucket=BUCKET, Key="{}{}.{}".format(outputPrefix, languageCode, entry["Key"].split("/")[-1]),
+                                         Body=translateDocument(document, self.translator))
+        job["JobStatus"] = "COMPLETED"
+        job["EndTime"] = datetime.now(timezone.utc)
+
+
+# Lambda client stand-in, keeps the follow-up invocations of an input scan cut short by the deadline
+class FakeLambda:
+
+    def __init__(self):
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.invocations.append(json.loads(Payload))
+        return {"StatusCode": 202}
+
+
+class FakeContext:
+
+    def __init__(self, timeoutMillis):
+        self.function_name = FUNCTION_ARN.split(":")[-1]
+        self.invoked_function_arn = FUNCTION_ARN
+        self.deadline = time.time() + timeoutMillis / 1000.0
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.time()) * 1000)
+
+
+# Wall time of the Captions methods of each stage, summed over the threads that call them
+class StageTimer:
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.lock = threading.Lock()
+        self.originals = {}
+
+    def install(self):
+        for stage, methodNames in TIMED_STAGES:
+            for methodName in methodNames:
+                original = getattr(Captions, methodName)
+                self.originals[methodName] = original
+                setattr(Captions, methodName, self.timed(stage, original))
+
+    def uninstall(self):
+        for methodName, original in self.originals.items():
+            setattr(Captions, methodName, original)
+
+    def timed(self, stage, method):
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self.lock:
+                    self.seconds[stage] += elapsed
+                    self.calls[stage] += 1
+        return call
+
+
+def uploadEvent(key, sequence):
+    return {"Records": [{"s3": {"bucket": {"name": BUCKET}, "object": {"key": key, "sequencer": "{:016X}".format(sequence)}}}]}
+
+
+def peakRssMegabytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def printS3Calls(label, s3client):
+    calls, seconds = s3client.reset()
+    summary = ", ".join("{} {} ({:.0f} ms)".format(name, calls[name], seconds[name] * 1000) for name in sorted(calls))
+    print("  S3 calls during {}: {}".format(label, summary or "none"))
+
+
+def runPipeline(arguments, rawS3):
+    s3client = CountingClient(rawS3)
+    translate = FakeTranslate(rawS3, arguments.translator, arguments.job_limit)
+    # job starts over the limit are left pending without waiting for the retries
+    captions_helper.JOB_START_RETRY_SECONDS = 0
+    lambdaClient = FakeLambda()
+    fakeClients = {"s3": s3client, "translate": translate, "lambda": lambdaClient}
+    originalGetClient = helper.AwsHelper.getClient
+    helper.AwsHelper.getClient = lambda self, name, awsRegion=None, maxPoolConnections=None: fakeClients[name]
+    timer = StageTimer()
+    timer.install()
+    os.environ.update({
+        "SOURCE_LANG_CODE": "en",
+        "TARGET_LANG_CODE": arguments.targets,
+        "S3_ROLE_ARN": "arn:aws:iam::{}:role/bench".format(ACCOUNT_ID),
+        "TRIGGER_NAME": TRIGGER_FILE,
+        "PROCESSING_MODE": arguments.mode,
+        "DELETE_INTERMEDIATE_FILES": "true",
+        "REALTIME_THRESHOLD_BYTES": str(arguments.realtime_threshold),
+        "TRANSLATION_MEMORY": arguments.translation_memory,
+        "MAX_WORKERS": str(arguments.workers),
+        "MAX_LINE_LENGTH": str(arguments.max_line_length),
+        "MAX_CAPTION_LINES": str(arguments.max_lines),
+        "MAX_CHARS_PER_SECOND": str(arguments.max_chars_per_second),
+        "SEGMENT_MODE": arguments.segment_mode,
+        "LOG_LEVEL": arguments.log_level,
+        "METRICS_NAMESPACE": arguments.metrics_namespace,
+    })
+    try:
+        started = time.perf_counter()
+        corpus = generateCorpus(arguments.files, arguments.cues, arguments.format, arguments.seed, arguments.markup)
+        stage("generate corpus", started, "{} files, {:.1f} MB".format(len(corpus), sum(map(len, corpus.values())) / 1e6))
+
+        started = time.perf_counter()
+        events = []
+        for sequence, (key, body) in enumerate(corpus.items()):
+            rawS3.put_object(Bucket=BUCKET, Key=key, Body=body)
+            events.append(uploadEvent(key, sequence))
+        if arguments.mode == "trigger":
+            rawS3.put_object(Bucket=BUCKET, Key="input/{}".format(TRIGGER_FILE), Body=b"")
+            events = [uploadEvent("input/{}".format(TRIGGER_FILE), len(events))]
+        else:
+            # S3 delivers events at least once, some are delivered twice
+            events.extend(events[:int(len(events) * arguments.duplicates)])
+        del corpus
+        stage("upload", started)
+
+        started = time.perf_counter()
+        invocations = len(events)
+        with ThreadPoolExecutor(max_workers=arguments.concurrency) as executor:
+            list(executor.map(lambda event: s3_event_handler.lambda_handler(event, FakeContext(arguments.timeout * 1000)), events))
+        while lambdaClient.invocations:
+            invocations += 1
+            s3_event_handler.lambda_handler(lambdaClient.invocations.pop(0), FakeContext(arguments.timeout * 1000))
+        stage("s3 event handler", started, "{} invocations, {} jobs".format(invocations, len(translate.jobs)))
+        printS3Calls("the s3 event handler", s3client)
+
+        translateSeconds = 0.0
+        handlerSeconds = 0.0
+        scheduled = 0
+        # jobs complete one after the other, the last completion removes the intermediate files. Jobs over the job
+        # limit are started by the scheduled invocations once the running jobs are done.
+        while True:
+            for jobId in translate.pendingJobs():
+                started = time.perf_counter()
+                translate.runJob(jobId)
+                translateSeconds += time.perf_counter() - started
+                started = time.perf_counter()
+                translate_job_event_handler.lambda_handler({"detail": {"jobId": jobId}}, FakeContext(arguments.timeout * 1000))
+                handlerSeconds += time.perf_counter() - started
+            if not rawS3.list_objects_v2(Bucket=BUCKET, Prefix=s3_event_handler.PENDING_BATCH_PREFIX).get("Contents"):
+                break
+            scheduled += 1
+            s3_event_handler.lambda_handler({"pendingBatches": True, "bucketName": BUCKET}, FakeContext(arguments.timeout * 1000))
+            if not translate.pendingJobs():
+                break
+        if scheduled:
+            print("{:<24} {:>9}   {} invocations".format("scheduled start", "", scheduled))
+        print("{:<24} {:>9.3f}s  {} characters".format("fake translate", translateSeconds, translate.characters))
+        print("{:<24} {:>9.3f}s  peak RSS {:.0f} MB".format("job event handler", handlerSeconds, peakRssMegabytes()))
+        printS3Calls("the job event handler", s3client)
+    finally:
+        helper.AwsHelper.getClient = originalGetClient
+        timer.uninstall()
+
+    print("Captions stages, summed over threads:")
+    for stageName, methodNames in TIMED_STAGES:
+        if timer.calls[stageName]:
+            print("  {:<22} {:>9.3f}s  {:>7} calls".format(stageName, timer.seconds[stageName], timer.calls[stageName]))
+    return checkOutputs(arguments, rawS3)
+
+
+def stage(label, started, detail=""):
+    print("{:<24} {:>9.3f}s  peak RSS {:.0f} MB  {}".format(label, time.perf_counter() - started, peakRssMegabytes(), detail))
+
+
+# Every input file must have one output per target language with the same number of cues, and no
+# intermediate file may be left behind
+def checkOutputs(arguments, rawS3):
+    listing = rawS3.list_objects_v2(Bucket=BUCKET, Prefix="", MaxKeys=10000000)
+    keys = [entry["Key"] for entry in listing.get("Contents", [])]
+    outputs = [key for key in keys if key.startswith("output/")]
+    targets = [code.strip() for code in arguments.targets.split(",") if code.strip()]
+    expected = arguments.files * len(targets)
+    leftovers = [key for key in keys if fnmatch(key, "captions-in/*") or fnmatch(key, "captions-timing/*")
+                 or fnmatch(key, "captions-tm/*") or fnmatch(key, "captions-shards/*") or fnmatch(key, "captions-pending/*")]
+    problems = []
+    if len(outputs) != expected:
+        problems.append("{} output files instead of {}".format(len(outputs), expected))
+    if leftovers:
+        problems.append("{} intermediate files left, first {}".format(len(leftovers), leftovers[0]))
+    for key in outputs[:20]:
+        body = rawS3.get_object(Bucket=BUCKET, Key=key)["Body"].read().decode("utf-8")
+        if arguments.max_lines == 0 and arguments.max_chars_per_second == 0 and body.count("-->") != arguments.cues:
+            problems.append("{} has {} cues instead of {}".format(key, body.count("-->"), arguments.cues))
+        if arguments.markup and (body.count("<i>") != body.count("</i>") or "<mark" in body or "<wbr" in body or "&lt;" in body):
+            problems.append("{} has unbalanced tags or placeholders left".format(key))
+    print("{} output files{}".format(len(outputs), "" if not problems else ": " + "; ".join(problems)))
+    return not problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the caption translation Lambda functions")
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--cues", type=int, default=1000)
+    parser.add_argument("--format", choices=("vtt", "srt", "mixed"), default="mixed")
+    parser.add_argument("--targets", default="es,fr")
+    parser.add_argument("--s3", choices=("memory", "moto"), default="memory")
+    parser.add_argument("--translator", choices=("echo", "pseudo"), default="pseudo")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--mode", choices=("upload", "trigger"), default="upload",
+                        help="one event per uploaded file, or one sweep of input/ started by the trigger file")
+    parser.add_argument("--job-limit", type=int, default=0, help="concurrent translation jobs, 0 for no limit")
+    parser.add_argument("--concurrency", type=int, default=4, help="upload events handled at the same time")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="fraction of the upload events delivered twice")
+    parser.add_argument("--realtime-threshold", type=int, default=0)
+    parser.add_argument("--translation-memory", default="none")
+    parser.add_argument("--segment-mode", choices=("off", "length", "timing"), default="off")
+    parser.add_argument("--max-line-length", type=int, default=42)
+    parser.add_argument("--max-lines", type=int, default=0)
+    parser.add_argument("--max-chars-per-second", type=int, default=0)
+    parser.add_argument("--timeout", type=int, default=900, help="Lambda timeout in seconds")
+    parser.add_argument("--markup", type=float, default=0.0, help="fraction of the cues with inline tags")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--metrics-namespace", default="", help="print the EMF metrics of every invocation in this namespace")
+    arguments = parser.parse_args()
+
+    print("{} files x {} cues ({}), targets {}, {} S3, {} translator".format(
+        arguments.files, arguments.cues, arguments.format, arguments.targets, arguments.s3, arguments.translator))
+    started = time.perf_counter()
+    if arguments.s3 == "moto":
+        import boto3
+        from moto import mock_aws
+        with mock_aws():
+            rawS3 = boto3.client("s3")
+            rawS3.create_bucket(Bucket=BUCKET)
+            ok = runPipeline(arguments, rawS3)
+    else:
+        ok = runPipeline(arguments, InMemoryS3())
+    elapsed = time.perf_counter() - started
+    print("total {:.3f}s, {:.0f} cues/s, peak RSS {:.0f} MB".format(
+        elapsed, arguments.files * arguments.cues / elapsed, peakRssMegabytes()))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# Micro-benchmark of the caption reflow: line wrapping alone, then wrapping with cue splitting and the
+# reading speed limit, on a track of long German-like captions. Checks the line limits and that the
+# reflowed timing stays monotonic.
+# Usage: python benchmarks/bench_reflow.py [cueCount] [maxLineLength] [maxLines] [maxCharsPerSecond]
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "translate_captions"))
+
+from caption_reflow import reflowTrack
+from caption_track import CaptionTrack
+
+WORDS = ("Geschwindigkeitsbegrenzung", "der", "die", "und", "Bahnhof", "nicht", "gestern,", "Entschuldigung.",
+         "Wir", "haben", "Donaudampfschiff", "zu", "spät", "angekommen", "aber", "trotzdem", "Frühstück!", "ein")
+
+
+def measure(label, cueCount, function, *arguments):
+    started = time.perf_counter()
+    result = function(*arguments)
+    elapsed = time.perf_counter() - started
+    print("{:<28} {:>8.3f}s {:>12.0f} cues/s".format(label, elapsed, cueCount / elapsed))
+    return result
+
+
+def main():
+    cueCount = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    maxLineLength = int(sys.argv[2]) if len(sys.argv) > 2 else 42
+    maxLines = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    maxCharsPerSecond = int(sys.argv[4]) if len(sys.argv) > 4 else 17
+    rng = random.Random(0)
+    track = CaptionTrack()
+    for i in range(cueCount):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 24)))
+        track.append(i * 3000, i * 3000 + rng.randint(800, 2900), text)
+
+    print("{} cues, {} characters per line, {} lines, {} characters per second".format(
+        cueCount, maxLineLength, maxLines, maxCharsPerSecond))
+    measure("wrap", cueCount, reflowTrack, track, maxLineLength)
+    reflowed = measure("wrap, split, reading speed", cueCount, reflowTrack, track, maxLineLength, maxLines, maxCharsPerSecond)
+
+    longLines = 0
+    for text in reflowed.texts():
+        lines = text.split("\n")
+        longLines += sum(1 for line in lines if len(line) > maxLineLength) + (len(lines) > maxLines)
+    backwards = sum(1 for i in range(1, len(reflowed)) if reflowed.starts[i] < reflowed.starts[i - 1])
+    inverted = sum(1 for i in range(len(reflowed)) if reflowed.ends[i] < reflowed.starts[i])
+    print("{} captions after reflow, {} over the line limits, {} out of order, {} ending before they start".format(
+        len(reflowed), longLines, backwards, inverted))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# Micro-benchmark of the segment mode against caption by caption translation on a track of sentences
+# broken over several captions: spans sent, characters billed and span marker overhead, and the
+# throughput of segmenting, encoding, aligning an identity translation and spreading it back.
+# Checks that every caption gets its own words back.
+# Usage: python benchmarks/bench_segments.py [cueCount]
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "translate_captions"))
+
+from caption_alignment import encodeCaptions, alignCaptions
+from caption_segments import segmentCaptions, segmentText, redistributeText
+from caption_track import CaptionTrack
+
+WORDS = ("the", "train", "was", "late", "again", "but", "nobody", "seemed", "to", "notice", "it", "we", "waited",
+         "on", "platform", "nine", "for", "an", "hour", "and", "then", "walked", "home")
+
+
+def buildTrack(cueCount, rng):
+    track = CaptionTrack()
+    position = 0
+    words = []
+    for i in range(cueCount):
+        if not words:
+            words = [rng.choice(WORDS) for _ in range(rng.randint(6, 30))]
+            words[-1] += rng.choice(".?!")
+        count = min(len(words), rng.randint(3, 8))
+        text = " ".join(words[:count])
+        words = words[count:]
+        track.append(position, position + 1800, text)
+        position += 2000 + (rng.randint(1000, 3000) if not words else 0)
+    return track
+
+
+def cueMode(track):
+    document = encodeCaptions(enumerate(track.texts()))
+    expected = list(range(len(track)))
+    translated, misaligned = alignCaptions(document, expected)
+    return document, expected, [translated[i] for i in expected]
+
+
+def segmentMode(track):
+    segments = segmentCaptions(track, range(len(track)))
+    document = encodeCaptions((segment[0], segmentText(track, segment)) for segment in segments)
+    expected = [segment[0] for segment in segments]
+    translated, misaligned = alignCaptions(document, expected)
+    lengths = [len(text) for text in track.texts()]
+    texts = [None] * len(track)
+    for segment in segments:
+        for index, text in zip(segment, redistributeText(translated[segment[0]], [lengths[i] for i in segment])):
+            texts[index] = text
+    return document, expected, texts
+
+
+def measure(label, track, function):
+    started = time.perf_counter()
+    document, expected, texts = function(track)
+    elapsed = time.perf_counter() - started
+    characters = len(" ".join(track.texts()))
+    print("{:<10} {:>8} spans {:>10} characters {:>6.1f}% markup {:>8.3f}s {:>10.0f} cues/s".format(
+        label, len(expected), len(document), 100.0 * (len(document) - characters) / len(document), elapsed,
+        len(track) / elapsed))
+    return texts
+
+
+def main():
+    cueCount = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    track = buildTrack(cueCount, random.Random(0))
+    print("{} cues".format(cueCount))
+    measure("captions", track, cueMode)
+    texts = measure("segments", track, segmentMode)
+    moved = sum(1 for source, text in zip(track.texts(), texts) if source != text)
+    print("{} captions with words moved to a neighbour".format(moved))
+
+
+if __name__ == "__main__":
+    main()
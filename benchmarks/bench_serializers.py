@@ -0,0 +1,91 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# Micro-benchmark of the SRT/VTT serializers: the previous float/zfill formatter with string
+# concatenation against the integer column formatter writing into a StringIO.
+# Usage: python benchmarks/bench_serializers.py [cueCount]
+
+import math
+import os
+import sys
+import time
+from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "translate_captions"))
+
+from caption_track import CaptionTrack, writeSRT, writeVTT
+
+
+def legacyFormatTime(timeSeconds, separator):
+    ONE_HOUR = 60 * 60
+    ONE_MINUTE = 60
+    hours = math.floor(timeSeconds / ONE_HOUR)
+    remainder = timeSeconds - (hours * ONE_HOUR)
+    minutes = math.floor(remainder / 60)
+    remainder = remainder - (minutes * ONE_MINUTE)
+    seconds = math.floor(remainder)
+    remainder = remainder - seconds
+    millis = remainder
+    return str(hours).zfill(2) + ':' + str(minutes).zfill(2) + ':' + str(seconds).zfill(2) + separator + str(math.floor(millis * 1000)).zfill(3)
+
+
+def legacySRT(captions):
+    srt = ''
+    index = 1
+    for caption in captions:
+        srt += str(index) + '\n'
+        srt += legacyFormatTime(float(caption["start"]), ',') + ' --> ' + legacyFormatTime(float(caption["end"]), ',') + '\n'
+        srt += caption["caption"] + '\n\n'
+        index += 1
+    return srt.rstrip()
+
+
+def legacyVTT(captions):
+    vtt = 'WEBVTT\n\n'
+    for caption in captions:
+        vtt += legacyFormatTime(float(caption["start"]), '.') + ' --> ' + legacyFormatTime(float(caption["end"]), '.') + '\n'
+        vtt += caption["caption"] + '\n\n'
+    return vtt.rstrip()
+
+
+def trackSRT(track):
+    out = StringIO()
+    writeSRT(track, out)
+    return out.getvalue().rstrip()
+
+
+def trackVTT(track):
+    out = StringIO()
+    writeVTT(track, out)
+    return out.getvalue().rstrip()
+
+
+def measure(label, cueCount, function, argument):
+    started = time.perf_counter()
+    function(argument)
+    elapsed = time.perf_counter() - started
+    print("{:<20} {:>8.3f}s {:>12.0f} cues/s".format(label, elapsed, cueCount / elapsed))
+
+
+def main():
+    cueCount = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    track = CaptionTrack()
+    captions = []
+    for i in range(cueCount):
+        start, end, text = i * 2001, i * 2001 + 1999, "Caption number {} of the benchmark track".format(i)
+        track.append(start, end, text)
+        captions.append({"start": str(start / 1000.0), "end": str(end / 1000.0), "caption": text})
+
+    print("{} cues".format(cueCount))
+    measure("legacy SRT", cueCount, legacySRT, captions)
+    measure("CaptionTrack SRT", cueCount, trackSRT, track)
+    measure("legacy VTT", cueCount, legacyVTT, captions)
+    measure("CaptionTrack VTT", cueCount, trackVTT, track)
+
+    # The legacy formatter floors float seconds and loses milliseconds (1.001 -> 1.000)
+    mismatches = sum(1 for a, b in zip(legacySRT(captions).split("\n"), trackSRT(track).split("\n")) if a != b)
+    print("timestamp lines that differ from the exact formatter: {}".format(mismatches))
+
+
+if __name__ == "__main__":
+    main()
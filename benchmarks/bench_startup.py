@@ -0,0 +1,148 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# Startup benchmark of the Lambda functions. Every measurement runs in a fresh interpreter:
+# - the import time of each handler module and of the offline CLI, from a -X importtime profile, with the
+#   modules that take the longest and whether boto3 was loaded by the import
+# - the time to create the boto3 clients the handlers create during the Lambda init phase
+# - the import and init time of the S3 event handler, then a cold and a warm invocation on the in-memory
+#   harness of bench_pipeline, one short caption file each, translated synchronously
+# Exits with 1 when a handler import takes more than --max-import-ms or loads boto3, to catch regressions.
+# Usage: python benchmarks/bench_startup.py [--repeat 5] [--top 10] [--max-import-ms 150]
+
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(BENCH_DIR, "..", "translate_captions")
+HANDLER_MODULES = ("s3_event_handler", "translate_job_event_handler")
+MODULES = HANDLER_MODULES + ("caption_cli",)
+AWS_CLIENTS = ("s3", "translate")
+
+
+# Run this script again in a fresh interpreter with arguments, returns its standard output and error
+def runChild(arguments, pythonOptions=()):
+    environment = dict(os.environ)
+    environment.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    environment.pop("AWS_LAMBDA_FUNCTION_NAME", None)
+    result = subprocess.run([sys.executable] + list(pythonOptions) + list(arguments), cwd=SOURCE_DIR, env=environment,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return result.stdout, result.stderr
+
+
+# Parse a -X importtime profile into {module: (self microseconds, cumulative microseconds)}
+def parseImportTimes(profile):
+    times = {}
+    for line in profile.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        selfTime, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(selfTime), int(cumulative))
+    return times
+
+
+def measureImports(arguments):
+    failed = False
+    for module in MODULES:
+        totals = []
+        selfTimes = {}
+        for _ in range(arguments.repeat):
+            out, profile = runChild(["-c", "import {}".format(module)], ["-X", "importtime"])
+            times = parseImportTimes(profile)
+            totals.append(times[module][1] / 1000.0)
+            for name, (selfTime, cumulative) in times.items():
+                selfTimes.setdefault(name, []).append(selfTime / 1000.0)
+        median = statistics.median(totals)
+        botoLoaded = "boto3" in selfTimes
+        print("import {:<28} {:>8.1f} ms (median of {}){}".format(module, median, arguments.repeat,
+                                                                   ", loads boto3" if botoLoaded else ""))
+        slowest = sorted(((statistics.median(values), name) for name, values in selfTimes.items()), reverse=True)
+        for selfTime, name in slowest[:arguments.top]:
+            print("    {:<40} {:>8.1f} ms".format(name, selfTime))
+        if module in HANDLER_MODULES and (botoLoaded or (arguments.max_import_ms and median > arguments.max_import_ms)):
+            failed = True
+    return failed
+
+
+# Child: import boto3 and create the clients the handlers create at init (see helper.initClients)
+def childClients():
+    started = time.perf_counter()
+    import boto3
+    imported = time.perf_counter()
+    for name in AWS_CLIENTS:
+        boto3.client(name)
+    print(json.dumps({"import": imported - started, "clients": time.perf_counter() - imported}))
+
+
+# Child: time the import of the S3 event handler, then a cold and a warm invocation on the in-memory harness
+def childInvoke():
+    os.environ.update({
+        "SOURCE_LANG_CODE": "en",
+        "TARGET_LANG_CODE": "es",
+        "S3_ROLE_ARN": "arn:aws:iam::123456789012:role/bench",
+        "TRIGGER_NAME": "start",
+        "PROCESSING_MODE": "upload",
+        "REALTIME_THRESHOLD_BYTES": "100000",
+        "LOG_LEVEL": "WARNING",
+        "METRICS_NAMESPACE": "",
+    })
+    sys.path.insert(0, SOURCE_DIR)
+    started = time.perf_counter()
+    import s3_event_handler
+    imported = time.perf_counter()
+    # loaded by helper.initClients during the Lambda init phase, the harness replaces the clients themselves
+    import boto3
+    initialized = time.perf_counter()
+    import helper
+    import bench_pipeline
+
+    rawS3 = bench_pipeline.InMemoryS3()
+    fakeClients = {"s3": rawS3, "translate": bench_pipeline.FakeTranslate(rawS3, "pseudo"), "lambda": bench_pipeline.FakeLambda()}
+    helper.AwsHelper.getClient = lambda self, name, awsRegion=None, maxPoolConnections=None: fakeClients[name]
+    rng = random.Random(0)
+    timings = {"import": imported - started, "init": initialized - started}
+    for label, sequence in (("cold", 0), ("warm", 1)):
+        key = "input/clip{}.vtt".format(sequence)
+        rawS3.put_object(Bucket=bench_pipeline.BUCKET, Key=key, Body=bench_pipeline.generateCaptions(100, "vtt", rng))
+        started = time.perf_counter()
+        s3_event_handler.lambda_handler(bench_pipeline.uploadEvent(key, sequence), bench_pipeline.FakeContext(900000))
+        timings[label] = time.perf_counter() - started
+        if "output/es.clip{}.vtt".format(sequence) not in rawS3.objects:
+            raise RuntimeError("{} invocation wrote no output".format(label))
+    print(json.dumps(timings))
+
+
+def measureInvocations(arguments):
+    clients = [json.loads(runChild([os.path.abspath(__file__), "--child", "clients"])[0]) for _ in range(arguments.repeat)]
+    print("boto3 import {:>30.1f} ms".format(statistics.median(c["import"] for c in clients) * 1000))
+    print("create {} clients {:>24.1f} ms  (Lambda init phase)".format("/".join(AWS_CLIENTS),
+                                                                       statistics.median(c["clients"] for c in clients) * 1000))
+    runs = [json.loads(runChild([os.path.abspath(__file__), "--child", "invoke"])[0].splitlines()[-1]) for _ in range(arguments.repeat)]
+    for label in ("import", "init", "cold", "warm"):
+        print("s3 event handler {:<12} {:>14.1f} ms".format(label, statistics.median(run[label] for run in runs) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time and cold start benchmark of the caption translation Lambda functions")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="slowest modules listed per import, by self time")
+    parser.add_argument("--max-import-ms", type=float, default=0, help="fail when a handler import takes longer, 0 to only report")
+    parser.add_argument("--child", choices=("clients", "invoke"), help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+    if arguments.child == "clients":
+        return childClients()
+    if arguments.child == "invoke":
+        return childInvoke()
+    failed = measureImports(arguments)
+    measureInvocations(arguments)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+
+# The modules of the Lambda functions import each other by name from this folder
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from caption_cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import html
+import re
+from caption_markup import protectTags,restoreTags
+
+# Every caption of a delimited document is wrapped in a span carrying its index in the caption track,
+# so a translated document can be matched back caption by caption even when Translate merges, drops or
+# reorders spans.
+CAPTION_SPAN = '<span id="c{}">{}</span>'
+LEGACY_DELIMITER = "<span>"
+# Captions on each side of a dropped or moved span that are translated again with it
+ALIGNMENT_WINDOW = 2
+
+_captionSpanPattern = re.compile(r"""<span\s+id\s*=\s*["']?c(\d+)["']?\s*>(.*?)</span\s*>""", re.S | re.I)
+_tagPattern = re.compile(r"</?span[^>]*>", re.I)
+_closingSpanPattern = re.compile(r"</span\s*>", re.I)
+
+
+class CaptionAlignmentError(ValueError):
+    pass
+
+
+# Encode (index, text) pairs as one document. Inline tags are replaced by placeholders (see caption_markup),
+# the tags of every caption that has some are added to tags ({index: tags}) when given.
+def encodeCaptions(entries, tags=None):
+    spans = []
+    for index, text in entries:
+        text, captionTags = protectTags(text)
+        if captionTags and tags is not None:
+            tags[index] = captionTags
+        spans.append(CAPTION_SPAN.format(index, text))
+    return "".join(spans)
+
+
+# Split a document written by encodeCaptions into its caption spans, in order
+def splitCaptions(document):
+    return [match.group(0) for match in _captionSpanPattern.finditer(document)]
+
+
+# Decode a document written by encodeCaptions, translated or not, into {index: text}, with the inline tags
+# ({index: tags} from encodeCaptions) put back. When Translate duplicates a span the first one is kept.
+# Documents of the earlier format are mapped onto the expected indexes (see legacyCaptions).
+def decodeCaptions(document, expected=None, delimiter=LEGACY_DELIMITER, tags=None):
+    tags = tags or {}
+    captions = {}
+    for match in _captionSpanPattern.finditer(document):
+        index = int(match.group(1))
+        if index not in captions:
+            captions[index] = restoreTags(match.group(2), tags.get(index)).strip()
+    if not captions and expected is not None:
+        captions = legacyCaptions(document, expected, delimiter) or {}
+    return captions
+
+
+# Captions of a document of the earlier format, separated by bare <span> markers, mapped onto the expected
+# indexes in order. None unless the document has no closing span and exactly one caption per expected index:
+# numbered spans that lost their ids must not shift the captions.
+def legacyCaptions(document, expected, delimiter=LEGACY_DELIMITER):
+    if not document or _closingSpanPattern.search(document):
+        return None
+    pieces = html.unescape(document).split(delimiter)
+    if len(pieces) != len(expected):
+        return None
+    return dict(zip(expected, pieces))
+
+
+# Decode a translated document and validate it against the expected indexes in one pass. Returns
+# {index: text} and the sorted indexes to translate again: the expected captions missing from the translation,
+# the captions Translate duplicated or moved out of order, and the captions within window of them, which
+# usually absorbed the text of a dropped span. Inline tags ({index: tags}) are put back.
+def alignCaptions(document, expected, delimiter=LEGACY_DELIMITER, window=ALIGNMENT_WINDOW, tags=None):
+    tags = tags or {}
+    captions = {}
+    suspects = []
+    previous = None
+    for match in _captionSpanPattern.finditer(document):
+        index = int(match.group(1))
+        if index in captions:
+            suspects.append(index)
+        else:
+            captions[index] = restoreTags(match.group(2), tags.get(index)).strip()
+        if previous is not None and index <= previous:
+            suspects.append(previous)
+            suspects.append(index)
+        previous = index
+    if not captions:
+        captions = legacyCaptions(document, expected, delimiter) or {}
+    positions = {}
+    for position, index in enumerate(expected):
+        positions[index] = position
+        if index not in captions:
+            suspects.append(index)
+    misaligned = set()
+    for index in suspects:
+        position = positions.get(index)
+        if position is not None:
+            misaligned.update(expected[max(0, position - window):position + window + 1])
+    return captions, sorted(misaligned)
+
+
+# Text of a translated single caption request whose span was lost, with its inline tags put back
+def stripCaptionSpans(document, tags=None):
+    return restoreTags(_tagPattern.sub("", document), tags).strip()
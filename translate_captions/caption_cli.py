@@ -0,0 +1,186 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# Offline caption pipeline: convert, delimit or translate and reassemble every VTT/SRT file of a directory (or an
+# S3 prefix) on a pool of worker processes, without the Lambda functions or batch translation jobs. Translation
+# goes through a pluggable translator, a function (document, sourceLanguageCode, targetLanguageCode) -> document
+# that keeps the numbered caption spans of the delimited document.
+#
+#   python -m translate_captions INPUT OUTPUT [--stage translate] [--target-languages es,fr] [--translator pseudo]
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from captions_helper import Captions
+from caption_storage import openStorage
+from caption_segments import segmentText
+from caption_alignment import encodeCaptions,stripCaptionSpans
+from caption_translators import loadTranslator
+import instrumentation
+
+logger = instrumentation.getLogger(__name__)
+
+CAPTION_EXTENSIONS = ["vtt", "srt"]
+STAGES = ("convert", "delimit", "translate")
+SEGMENT_WEIGHTINGS = ("length", "timing")
+# Stages reported in the statistics, in pipeline order
+REPORTED_STAGES = ("Fetch", "Parse", "Delimit", "Translate", "Reassemble", "Reflow", "Serialize", "Write")
+
+# Key of the output of key: the same folder, prefixed with the target language like the output/ folder of the
+# Lambda functions, in outputFormat (vtt, srt, delimited) or the format of the source when None
+def outputKey(key, targetLanguageCode, outputFormat):
+    folder, _, fileName = key.rpartition("/")
+    if outputFormat:
+        fileName = "{}.{}".format(fileName.rsplit(".", 1)[0], outputFormat)
+    if targetLanguageCode:
+        fileName = "{}.{}".format(targetLanguageCode, fileName)
+    return "{}/{}".format(folder, fileName) if folder else fileName
+
+
+# Run the pipeline on one caption file, in a worker process. Returns the counts and stage times of the file.
+def processCaptionFile(key, inputStorage, outputStorage, settings):
+    instrumentation.drain()
+    captions = Captions()
+    result = {"Key": key, "Cues": 0, "Outputs": 0}
+    try:
+        track = captions.loadCaptions(inputStorage, key)
+        result["Cues"] = len(track)
+        stage = settings["stage"]
+        sourceFormat = key.rsplit(".", 1)[-1].lower()
+        if stage == "convert":
+            with instrumentation.timer("Serialize"):
+                content = captions.serializeCaptions(track, settings["outputFormat"] or sourceFormat)
+            writeOutput(outputStorage, outputKey(key, None, settings["outputFormat"]), content, result)
+            return result
+
+        segmentWeighting = settings["segmentMode"] if settings["segmentMode"] in SEGMENT_WEIGHTINGS else None
+        with instrumentation.timer("Delimit"):
+            segments = captions.SegmentCaptions(track) if segmentWeighting else None
+            tags = {}
+            delimitedFile = captions.ConvertToDemilitedFiles(track, segments=segments, tags=tags)
+        if stage == "delimit":
+            writeOutput(outputStorage, outputKey(key, None, "delimited"), delimitedFile, result)
+            return result
+
+        if segments is not None:
+            expected = [segment[0] for segment in segments]
+            sourceCaptions = dict((segment[0], segmentText(track, segment)) for segment in segments)
+            weights = captions.segmentWeights(track, segmentWeighting)
+        else:
+            expected = list(range(len(track)))
+            sourceCaptions = dict(enumerate(track.texts()))
+            weights = None
+        translator = loadTranslator(settings["translator"])
+        for targetLanguageCode in settings["targetLanguages"]:
+            with instrumentation.timer("Translate"):
+                translatedFile = translator(delimitedFile, settings["sourceLanguage"], targetLanguageCode)
+
+            # misaligned spans are translated again one by one
+            def recover(indexes):
+                with instrumentation.timer("Translate"):
+                    return dict((i, stripCaptionSpans(translator(encodeCaptions([(i, sourceCaptions[i])]), settings["sourceLanguage"],
+                                                                 targetLanguageCode), tags.get(i)))
+                                for i in indexes)
+
+            layout = (settings["maxLineLength"], settings["maxLines"], settings["maxCharsPerSecond"])
+            content, _ = captions.ReassembleCaptions(track, translatedFile, expected, settings["outputFormat"] or sourceFormat, layout,
+                                                     recover=recover, segments=segments, weights=weights, tags=tags)
+            writeOutput(outputStorage, outputKey(key, targetLanguageCode, settings["outputFormat"]), content, result)
+    except Exception as e:
+        logger.error("Error processing {}: {}".format(inputStorage.location(key), e))
+        result["Error"] = str(e)
+    finally:
+        result["Timers"], counters = instrumentation.drain()
+        result["ReadBytes"] = counters.get("ReadBytes", 0)
+        result["WrittenBytes"] = counters.get("WrittenBytes", 0)
+    return result
+
+
+def writeOutput(outputStorage, key, content, result):
+    with instrumentation.timer("Write"):
+        outputStorage.write(content, key)
+    result["Outputs"] += 1
+
+
+# Process every caption file (keys) of inputStorage into outputStorage on workers processes, or in the calling
+# process when workers is 1 (for profilers). Returns the summary printed by printSummary.
+def processCaptionFiles(inputStorage, outputStorage, keys, settings, workers=None):
+    started = time.perf_counter()
+    summary = {"Files": 0, "Failed": 0, "Cues": 0, "Outputs": 0, "ReadBytes": 0, "WrittenBytes": 0, "Timers": {}}
+    if workers == 1:
+        results = (processCaptionFile(key, inputStorage, outputStorage, settings) for key in keys)
+        collectResults(summary, results)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(processCaptionFile, key, inputStorage, outputStorage, settings) for key in keys]
+            collectResults(summary, (future.result() for future in futures))
+    summary["Seconds"] = time.perf_counter() - started
+    return summary
+
+
+def collectResults(summary, results):
+    for result in results:
+        summary["Files"] += 1
+        summary["Failed"] += 1 if "Error" in result else 0
+        for name in ("Cues", "Outputs", "ReadBytes", "WrittenBytes"):
+            summary[name] += result.get(name, 0)
+        for stage, seconds in result["Timers"].items():
+            summary["Timers"][stage] = summary["Timers"].get(stage, 0.0) + seconds
+
+
+# Throughput over the wall time, and the time of every stage summed over the worker processes
+def printSummary(summary, out=sys.stdout):
+    seconds = summary["Seconds"] or 1e-9
+    out.write("{} files ({} failed), {} cues, {} output files in {:.3f}s\n".format(
+        summary["Files"], summary["Failed"], summary["Cues"], summary["Outputs"], summary["Seconds"]))
+    out.write("{:.1f} files/s, {:.0f} cues/s, {:.2f} MB/s read, {:.2f} MB/s written\n".format(
+        summary["Files"] / seconds, summary["Cues"] / seconds, summary["ReadBytes"] / seconds / 1e6,
+        summary["WrittenBytes"] / seconds / 1e6))
+    timers = summary["Timers"]
+    total = sum(timers.values()) or 1e-9
+    for stage in REPORTED_STAGES + tuple(sorted(set(timers) - set(REPORTED_STAGES))):
+        if stage in timers:
+            out.write("  {:<12} {:>9.3f}s {:>5.1f}%\n".format(stage.lower(), timers[stage], 100.0 * timers[stage] / total))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m translate_captions",
+                                     description="Convert, delimit or translate every VTT/SRT file of a directory or an s3:// prefix")
+    parser.add_argument("input", help="directory or s3://bucket/prefix/ of the caption files, read recursively")
+    parser.add_argument("output", help="directory or s3://bucket/prefix/ of the results, same folder layout as the input")
+    parser.add_argument("--stage", choices=STAGES, default="translate",
+                        help="convert: parse and serialize, delimit: write the delimited files sent to Amazon Translate, "
+                             "translate: translate and reassemble (default)")
+    parser.add_argument("--source-language", default="en")
+    parser.add_argument("--target-languages", default="es", help="comma separated target language codes")
+    parser.add_argument("--translator", default="pseudo", help="identity, pseudo or module:function")
+    parser.add_argument("--output-format", choices=("vtt", "srt"), help="format of the captions written, the source format by default")
+    parser.add_argument("--segment-mode", choices=("off",) + SEGMENT_WEIGHTINGS, default="off")
+    parser.add_argument("--max-line-length", type=int, default=0)
+    parser.add_argument("--max-lines", type=int, default=0)
+    parser.add_argument("--max-chars-per-second", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes, 1 runs in this process")
+    arguments = parser.parse_args(argv)
+
+    settings = {
+        "stage": arguments.stage,
+        "sourceLanguage": arguments.source_language,
+        "targetLanguages": [code.strip() for code in arguments.target_languages.split(",") if code.strip()],
+        "translator": arguments.translator,
+        "outputFormat": arguments.output_format,
+        "segmentMode": arguments.segment_mode,
+        "maxLineLength": arguments.max_line_length,
+        "maxLines": arguments.max_lines,
+        "maxCharsPerSecond": arguments.max_chars_per_second
+    }
+    if arguments.stage == "translate":
+        # fail before starting the workers when the translator does not exist
+        loadTranslator(arguments.translator)
+    inputStorage = openStorage(arguments.input)
+    outputStorage = openStorage(arguments.output)
+    keys = list(inputStorage.listKeys("", CAPTION_EXTENSIONS))
+    summary = processCaptionFiles(inputStorage, outputStorage, keys, settings, max(1, arguments.workers))
+    printSummary(summary)
+    return 1 if summary["Failed"] else 0
@@ -0,0 +1,150 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import html
+import re
+
+# Inline markup of caption text: VTT and SRT tags (<i>, </b>, <c.yellow>, <v Roger>, <font color="red">,
+# <00:00:01.000>) and the SSA override codes ({\an8}) found in SRT files. A "<" followed by a space is text.
+INLINE_TAG_PATTERN = re.compile(r"</?[A-Za-z0-9][^<>\n]*>|\{\\[^{}\n]*\}")
+_tagNamePattern = re.compile(r"</?([A-Za-z0-9]+)")
+# Characters of text written without spaces, with every tag kept as one unit
+_characterPattern = re.compile(INLINE_TAG_PATTERN.pattern + r"|.", re.S)
+
+# Inline tags are sent to Amazon Translate as numbered HTML placeholders that it keeps in place and moves with
+# the words they mark: <mark id="tK">...</mark> for a tag and its closing tag, <wbr id="tK"> for a tag on its own.
+# K is the position of the tag in the tags of the caption, [open tag, close tag] or [tag].
+PAIR_PLACEHOLDER = '<mark id="t{}">'
+PAIR_PLACEHOLDER_END = '</mark>'
+SINGLE_PLACEHOLDER = '<wbr id="t{}">'
+_placeholderPattern = re.compile(r"""<mark\s+id\s*=\s*["']?t(\d+)["']?\s*>|</mark\s*>|<wbr\s+id\s*=\s*["']?t(\d+)["']?\s*/?>""", re.I)
+
+
+def tagName(tag):
+    match = _tagNamePattern.match(tag)
+    return match.group(1).lower() if match else ""
+
+
+# Tags that open a span closed later: not closing tags, VTT timestamps or SSA codes
+def isOpeningTag(tag):
+    return tag[0] == "<" and tag[1] != "/" and not tag[1].isdigit()
+
+
+def stripTags(text):
+    return INLINE_TAG_PATTERN.sub("", text) if "<" in text or "{" in text else text
+
+
+# Replace the spaces inside tags (<v Roger>, <font color="red">) so that text split into words keeps every tag
+# whole, TAG_SPACE is turned back into a space once the words are joined again
+TAG_SPACE = "\ue000"
+
+
+def protectTagSpaces(text):
+    if "<" not in text:
+        return text
+    return INLINE_TAG_PATTERN.sub(lambda match: match.group(0).replace(" ", TAG_SPACE), text)
+
+
+def splitCharacters(text):
+    return _characterPattern.findall(text) if "<" in text or "{" in text else list(text)
+
+
+# Escape the text of a caption for an HTML document with its inline tags replaced by placeholders.
+# Returns the HTML and the tags of the caption, None when it has no markup.
+def protectTags(text):
+    if "<" not in text and "{" not in text:
+        return html.escape(text, quote=False), None
+    matches = list(INLINE_TAG_PATTERN.finditer(text))
+    if not matches:
+        return html.escape(text, quote=False), None
+    # pair every closing tag with the innermost open tag of the same name, tags left without a partner stand alone
+    closes = {}
+    stack = []
+    for position, match in enumerate(matches):
+        tag = match.group(0)
+        if isOpeningTag(tag):
+            stack.append((tagName(tag), position))
+        elif tag.startswith("</"):
+            name = tagName(tag)
+            for depth in range(len(stack) - 1, -1, -1):
+                if stack[depth][0] == name:
+                    closes[stack[depth][1]] = position
+                    del stack[depth:]
+                    break
+    parts = []
+    tags = []
+    closing = set(closes.values())
+    last = 0
+    for position, match in enumerate(matches):
+        parts.append(html.escape(text[last:match.start()], quote=False))
+        last = match.end()
+        if position in closing:
+            parts.append(PAIR_PLACEHOLDER_END)
+        elif position in closes:
+            parts.append(PAIR_PLACEHOLDER.format(len(tags)))
+            tags.append([match.group(0), matches[closes[position]].group(0)])
+        else:
+            parts.append(SINGLE_PLACEHOLDER.format(len(tags)))
+            tags.append([match.group(0)])
+    parts.append(html.escape(text[last:], quote=False))
+    return "".join(parts), tags
+
+
+# Unescape translated caption HTML and put the tags of the caption back in place of their placeholders.
+# A placeholder Translate dropped loses its tag; a tag whose closing placeholder was dropped is closed at the end.
+def restoreTags(translated, tags):
+    if not tags:
+        return html.unescape(translated)
+    parts = []
+    stack = []
+    last = 0
+    for match in _placeholderPattern.finditer(translated):
+        parts.append(html.unescape(translated[last:match.start()]))
+        last = match.end()
+        pair, single = match.group(1), match.group(2)
+        if pair is not None:
+            k = int(pair)
+            if k < len(tags):
+                parts.append(tags[k][0])
+                stack.append(k if len(tags[k]) > 1 else None)
+        elif single is not None:
+            k = int(single)
+            if k < len(tags):
+                parts.append(tags[k][0])
+        elif stack:
+            k = stack.pop()
+            if k is not None:
+                parts.append(tags[k][1])
+    parts.append(html.unescape(translated[last:]))
+    while stack:
+        k = stack.pop()
+        if k is not None:
+            parts.append(tags[k][1])
+    return "".join(parts)
+
+
+# Close the tags still open at the end of each piece of a caption split over consecutive captions and open them
+# again at the start of the next piece, so every caption is well formed on its own
+def balanceTags(pieces):
+    if not any("<" in piece for piece in pieces):
+        return pieces
+    balanced = []
+    carried = []
+    for piece in pieces:
+        if not piece.strip():
+            balanced.append(piece)
+            continue
+        stack = list(carried)
+        for match in INLINE_TAG_PATTERN.finditer(piece):
+            tag = match.group(0)
+            if isOpeningTag(tag):
+                stack.append(tag)
+            elif tag.startswith("</"):
+                name = tagName(tag)
+                for depth in range(len(stack) - 1, -1, -1):
+                    if tagName(stack[depth]) == name:
+                        del stack[depth]
+                        break
+        balanced.append("".join(carried) + piece + "".join("</{}>".format(tagName(tag)) for tag in reversed(stack)))
+        carried = stack
+    return balanced
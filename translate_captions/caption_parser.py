@@ -0,0 +1,152 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import codecs
+import re
+from collections import namedtuple
+
+# A single parsed cue. start/end are integer milliseconds.
+Cue = namedtuple("Cue", ["identifier", "start", "end", "settings", "text"])
+# A VTT block that is not a cue: the WEBVTT header, NOTE, STYLE and REGION blocks, kept as written
+Block = namedtuple("Block", ["text"])
+
+TIMING_SEPARATOR = "-->"
+READ_CHUNK_SIZE = 64 * 1024
+
+_timestampPattern = re.compile(r"^(?:(\d+):)?(\d{1,2}):(\d{1,2})[\.,](\d{1,3})$")
+
+
+class CaptionParseError(ValueError):
+    pass
+
+
+# Convert a VTT (HH:MM:SS.mmm / MM:SS.mmm) or SRT (HH:MM:SS,mmm) timestamp to milliseconds
+def parseTimestamp(timestamp):
+    match = _timestampPattern.match(timestamp.strip())
+    if match is None:
+        raise CaptionParseError("Invalid timestamp: {}".format(timestamp))
+    hours, minutes, seconds, millis = match.groups()
+    hours = int(hours) if hours else 0
+    return ((hours * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(millis.ljust(3, "0"))
+
+
+# Yield decoded lines from a byte stream (anything with read()), bytes or str.
+# A UTF-8 BOM is dropped and CRLF line endings are normalized.
+def iterLines(source, chunkSize=READ_CHUNK_SIZE):
+    if isinstance(source, str):
+        chunks = iter([source.lstrip("\ufeff")])
+        decoder = None
+    else:
+        if isinstance(source, (bytes, bytearray)):
+            chunks = iter([bytes(source)])
+        else:
+            chunks = iter(lambda: source.read(chunkSize), b"")
+        decoder = codecs.getincrementaldecoder("utf-8-sig")()
+
+    pending = ""
+    for chunk in chunks:
+        if decoder is not None:
+            chunk = decoder.decode(chunk)
+        if not chunk:
+            continue
+        # The last piece may be a partial line, keep it until the next chunk arrives
+        lines = (pending + chunk).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+    if decoder is not None:
+        pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+# Group lines into blocks separated by one or more blank lines
+def iterBlocks(lines):
+    block = []
+    for line in lines:
+        if line.strip():
+            block.append(line)
+        elif block:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+# Parse a caption block into a Cue, returns None for blocks that carry no timing line
+def parseBlock(block):
+    for position, line in enumerate(block):
+        if TIMING_SEPARATOR in line:
+            break
+    else:
+        return None
+
+    start, rest = line.split(TIMING_SEPARATOR, 1)
+    rest = rest.strip().split(None, 1)
+    if not rest:
+        raise CaptionParseError("Invalid timing line: {}".format(line))
+    end = rest[0]
+    settings = rest[1] if len(rest) > 1 else ""
+    identifier = "\n".join(block[:position]) if position else ""
+    text = "\n".join(block[position + 1:]).strip()
+    return Cue(identifier, parseTimestamp(start), parseTimestamp(end), settings, text)
+
+
+# Lazily yield the cues of a VTT stream, and with blocks the header, NOTE, STYLE and REGION blocks as Block
+def iterVTTItems(source, blocks=True):
+    blockLines = iterBlocks(iterLines(source))
+    header = next(blockLines, None)
+    if header is None:
+        return
+    if not header[0].startswith("WEBVTT"):
+        raise CaptionParseError("Missing WEBVTT header")
+    # The header block may run straight into the first cue when the blank line is missing
+    for position, line in enumerate(header):
+        if TIMING_SEPARATOR in line:
+            if blocks:
+                yield Block("\n".join(header[:position]))
+            cue = parseBlock(header[position:])
+            if cue is not None:
+                yield cue
+            break
+    else:
+        if blocks:
+            yield Block("\n".join(header))
+    for block in blockLines:
+        if block[0].startswith(("NOTE", "STYLE", "REGION")) and TIMING_SEPARATOR not in block[0]:
+            if blocks:
+                yield Block("\n".join(block))
+            continue
+        cue = parseBlock(block)
+        if cue is not None:
+            yield cue
+
+
+# Lazily yield the cues of a VTT stream. The WEBVTT header, NOTE, STYLE and REGION blocks are skipped.
+def iterVTTCues(source):
+    return iterVTTItems(source, False)
+
+
+# Lazily yield the cues of an SRT stream
+def iterSRTCues(source):
+    for block in iterBlocks(iterLines(source)):
+        cue = parseBlock(block)
+        if cue is not None:
+            yield cue
+
+
+# Yield the cues of a stream based on the caption file extension (vtt or srt)
+def iterCues(source, captionFormat):
+    captionFormat = captionFormat.lower()
+    if captionFormat == "vtt":
+        return iterVTTCues(source)
+    elif captionFormat == "srt":
+        return iterSRTCues(source)
+    raise CaptionParseError("Unsupported caption format: {}".format(captionFormat))
+
+
+# Yield the cues of a stream, and the Block items of a VTT stream (see iterVTTItems)
+def iterItems(source, captionFormat):
+    if captionFormat.lower() == "vtt":
+        return iterVTTItems(source)
+    return iterCues(source, captionFormat)
@@ -0,0 +1,193 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+from caption_track import CaptionTrack
+from caption_markup import TAG_SPACE,balanceTags,protectTagSpaces,stripTags
+
+# Lines preferably end after punctuation, and not after a short function word ("the", "de", "und")
+PUNCTUATION = frozenset(",.;:!?)]…、。，،")
+DIALOGUE_DASHES = ("-", "–", "—")
+WEAK_WORD_LENGTH = 3
+# Break costs, in characters of line length difference
+NO_PUNCTUATION_COST = 8
+WEAK_WORD_COST = 6
+# A greedy line is not cut shorter than this fraction of the maximum length to reach a better break
+MIN_LINE_FILL = 0.6
+
+
+# Cost of ending a line with word
+def breakCost(word):
+    if not word:
+        return NO_PUNCTUATION_COST
+    if word[-1] in PUNCTUATION:
+        return 0
+    if len(word) <= WEAK_WORD_LENGTH and word.islower():
+        return NO_PUNCTUATION_COST + WEAK_WORD_COST
+    return NO_PUNCTUATION_COST
+
+
+# Break words that fit in two lines where both lines are close in length
+def balancedBreak(words, length, maxLineLength):
+    target = length // 2
+    best = None
+    bestCost = None
+    lineLength = -1
+    for k in range(len(words) - 1):
+        lineLength += len(words[k]) + 1
+        if lineLength > maxLineLength:
+            break
+        if length - lineLength - 1 > maxLineLength:
+            continue
+        cost = abs(lineLength - target) + breakCost(words[k])
+        if bestCost is None or cost < bestCost:
+            best, bestCost = k + 1, cost
+    return best
+
+
+# Number of words of the first line: as full as possible, preferring punctuation
+def greedyBreak(words, start, maxLineLength):
+    minLength = int(maxLineLength * MIN_LINE_FILL)
+    best = None
+    bestCost = None
+    lineLength = -1
+    for k in range(start, len(words)):
+        lineLength += len(words[k]) + 1
+        if lineLength > maxLineLength:
+            break
+        if lineLength >= minLength:
+            cost = maxLineLength - lineLength + breakCost(words[k])
+            if bestCost is None or cost < bestCost:
+                best, bestCost = k + 1, cost
+    else:
+        return len(words)
+    if best is None:
+        best = max(k, start + 1)
+    return best
+
+
+# Lines are measured and broken on the visible text, inline tags take no room
+def wrapParagraph(text, maxLineLength):
+    words = text.split()
+    if not words:
+        return []
+    visible = [stripTags(word) for word in words] if "<" in text or "{" in text else words
+    if max(map(len, visible)) > maxLineLength:
+        # words longer than a line are cut, words with tags are kept whole
+        words = [piece for word, shown in zip(words, visible) for piece in
+                 ([word] if shown != word else [word[i:i + maxLineLength] for i in range(0, len(word), maxLineLength)])]
+        visible = [stripTags(word) for word in words]
+    length = sum(map(len, visible)) + len(visible) - 1
+    if length <= maxLineLength:
+        return [" ".join(words)]
+    if length <= 2 * maxLineLength + 1:
+        k = balancedBreak(visible, length, maxLineLength)
+        if k is not None:
+            return [" ".join(words[:k]), " ".join(words[k:])]
+    lines = []
+    start = 0
+    while start < len(words):
+        end = greedyBreak(visible, start, maxLineLength)
+        lines.append(" ".join(words[start:end]))
+        start = end
+    return lines
+
+
+# Wrap caption text to lines of at most maxLineLength characters. Whitespace is collapsed, line breaks
+# are only kept before dialogue dashes. Words longer than a line are cut. Inline tags are never broken.
+def wrapText(text, maxLineLength):
+    if "<" in text:
+        protected = protectTagSpaces(text)
+        if protected != text:
+            return [line.replace(TAG_SPACE, " ") for line in wrapText(protected, maxLineLength)]
+    if "\n" not in text:
+        return wrapParagraph(text, maxLineLength)
+    paragraphs = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if paragraphs and not line.startswith(DIALOGUE_DASHES):
+            paragraphs[-1] += " " + line
+        else:
+            paragraphs.append(line)
+    lines = []
+    for paragraph in paragraphs:
+        lines.extend(wrapParagraph(paragraph, maxLineLength))
+    return lines
+
+
+# Visible characters of lines
+def lineChars(lines):
+    chars = sum(map(len, lines))
+    for line in lines:
+        if "<" in line or "{" in line:
+            return sum(len(stripTags(line)) for line in lines)
+    return chars
+
+
+# Reflow a track: wrap every caption to maxLineLength, split captions of more than maxLines lines into
+# consecutive captions sharing the time in proportion to their text, and when maxCharsPerSecond is set,
+# give captions read too fast more time by extending them into the gap before the next caption, and when
+# the gap is too short, by merging the next caption in as long as the text fits in maxLines. Captions only
+# grow into time that no other caption uses, so the timing stays monotonic. Inline tags open at a split are
+# closed and opened again, the parts of a split caption keep its settings and the first one its identifier.
+# Returns a new track.
+def reflowTrack(track, maxLineLength, maxLines=0, maxCharsPerSecond=0):
+    starts = track.starts
+    ends = track.ends
+    cues = []
+    for i, text in enumerate(track.texts()):
+        lines = wrapText(text, maxLineLength) if maxLineLength > 0 else text.split("\n")
+        start, end = starts[i], ends[i]
+        if maxLines > 0 and len(lines) > maxLines:
+            chunks = [lines[j:j + maxLines] for j in range(0, len(lines), maxLines)]
+            total = lineChars(lines) or 1
+            done = 0
+            balanced = balanceTags(["\n".join(chunk) for chunk in chunks])
+            for k, chunk in enumerate(chunks):
+                chunkStart = start + (end - start) * done // total
+                done += lineChars(chunk)
+                cues.append([chunkStart, start + (end - start) * done // total, balanced[k].split("\n"), i, k == 0])
+        else:
+            cues.append([start, end, lines, i, True])
+
+    reflowed = CaptionTrack()
+    reflowed.header = track.header
+    hasFormat = track.identifiers is not None or track.settings is not None or bool(track.blocks)
+    blocks = track.blocks or {}
+    position = 0
+    while position < len(cues):
+        start, end, lines, source, first = cues[position]
+        if hasFormat:
+            if first:
+                for block in blocks.get(source, ()):
+                    reflowed.addBlock(block)
+            reflowed.setCueFormat(len(reflowed), track.identifier(source) if first else "", track.cueSettings(source))
+        position += 1
+        while maxCharsPerSecond > 0:
+            required = start + -(-lineChars(lines) * 1000 // maxCharsPerSecond)
+            if required <= end:
+                break
+            nextStart = cues[position][0] if position < len(cues) else None
+            if nextStart is None or required <= nextStart:
+                end = required
+                break
+            # the gap is too short: take all of it, then merge the next caption when the text still fits
+            end = max(end, nextStart)
+            if maxLines <= 0:
+                break
+            merged = lines + cues[position][2]
+            if maxLineLength > 0 and lineChars(merged) + len(merged) - 1 > maxLines * maxLineLength:
+                break
+            if maxLineLength > 0:
+                merged = wrapText("\n".join(merged), maxLineLength)
+            if len(merged) > maxLines:
+                break
+            lines = merged
+            end = max(end, cues[position][1])
+            if hasFormat and cues[position][4]:
+                for block in blocks.get(cues[position][3], ()):
+                    reflowed.addBlock(block)
+            position += 1
+        reflowed.append(start, end, "\n".join(lines))
+    for block in blocks.get(len(track), ()):
+        reflowed.addBlock(block)
+    return reflowed
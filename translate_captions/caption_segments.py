@@ -0,0 +1,125 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+from bisect import bisect_left
+from caption_markup import TAG_SPACE,balanceTags,protectTagSpaces,splitCharacters,stripTags
+
+# Consecutive captions are merged into sentence segments so Translate sees whole sentences. A segment
+# ends with sentence punctuation, a dialogue change, a pause or one of the size limits.
+SENTENCE_END = frozenset(".!?…。！？")
+CLOSING_QUOTES = "\"'»”’)]"
+DIALOGUE_DASHES = ("-", "–", "—")
+PUNCTUATION = frozenset(",.;:!?…、。，！？")
+MAX_SEGMENT_CAPTIONS = 6
+MAX_SEGMENT_CHARS = 400
+MAX_SEGMENT_GAP_MILLIS = 1500
+# A segment break is moved up to this many characters to land after punctuation
+PUNCTUATION_WINDOW = 6
+# Text in scripts written without spaces (CJK and later blocks) is split between characters
+CJK_FIRST_CODEPOINT = 0x2E80
+
+
+def isSentenceEnd(text):
+    text = stripTags(text).rstrip().rstrip(CLOSING_QUOTES)
+    return not text or text[-1] in SENTENCE_END
+
+
+# Group the caption indexes (ascending) of a track into segments, lists of consecutive caption indexes
+def segmentCaptions(track, indexes, maxCaptions=MAX_SEGMENT_CAPTIONS, maxChars=MAX_SEGMENT_CHARS,
+                    maxGapMillis=MAX_SEGMENT_GAP_MILLIS):
+    starts = track.starts
+    ends = track.ends
+    segments = []
+    current = []
+    chars = 0
+    previous = None
+    for index in indexes:
+        text = track.text(index)
+        visible = stripTags(text)
+        dialogue = visible.lstrip().startswith(DIALOGUE_DASHES) or "\n-" in visible
+        if current and (index != previous + 1 or dialogue or len(current) >= maxCaptions
+                        or chars + len(text) > maxChars or starts[index] - ends[previous] > maxGapMillis):
+            segments.append(current)
+            current = []
+            chars = 0
+        current.append(index)
+        chars += len(text) + 1
+        previous = index
+        if dialogue or isSentenceEnd(text):
+            segments.append(current)
+            current = []
+            chars = 0
+    if current:
+        segments.append(current)
+    return segments
+
+
+# Rebuild the segments from their first caption indexes and the indexes that were sent: a segment runs
+# up to the next segment start
+def segmentsFromStarts(segmentStarts, indexes):
+    segments = []
+    startSet = set(segmentStarts)
+    for index in indexes:
+        if index in startSet or not segments:
+            segments.append([index])
+        else:
+            segments[-1].append(index)
+    return segments
+
+
+def segmentText(track, segment):
+    return " ".join(" ".join(track.text(index).split()) for index in segment)
+
+
+# Split a translated segment over its captions in proportion to weights (source length or duration).
+# Breaks fall between words, or between characters for text written without spaces, and move to a nearby
+# punctuation mark when there is one. Inline tags stay whole, tags open at a break are closed and opened again
+# in the next caption. Returns one text per weight.
+def redistributeText(text, weights):
+    count = len(weights)
+    if count == 1:
+        return [text.strip()]
+    text = text.strip()
+    markup = "<" in text
+    if markup:
+        text = protectTagSpaces(text)
+    units = text.split()
+    joiner = " "
+    if len(units) < count and " " not in text and any(ord(c) >= CJK_FIRST_CODEPOINT for c in text):
+        units = splitCharacters(text)
+        joiner = ""
+    if not units:
+        return [""] * count
+    # ends[u] is the text length up to and including unit u
+    ends = []
+    length = -len(joiner)
+    for unit in units:
+        length += len(unit) + len(joiner)
+        ends.append(length)
+    if not sum(weights):
+        weights = [1] * count
+    totalWeight = float(sum(weights))
+    pieces = []
+    first = 0
+    cumulative = 0.0
+    for k in range(count - 1):
+        cumulative += weights[k]
+        if first >= len(units):
+            pieces.append("")
+            continue
+        target = length * cumulative / totalWeight
+        # the piece ends with unit position, leaving at least one unit for each of the remaining captions when possible
+        last = max(first, len(units) - (count - k - 1) - 1)
+        position = min(max(bisect_left(ends, target), first), last)
+        if position > first and abs(ends[position - 1] - target) < abs(ends[position] - target):
+            position -= 1
+        for candidate in range(max(first, position - 2), min(last, position + 2) + 1):
+            if units[candidate][-1] in PUNCTUATION and abs(ends[candidate] - target) <= PUNCTUATION_WINDOW:
+                position = candidate
+                break
+        pieces.append(joiner.join(units[first:position + 1]))
+        first = position + 1
+    pieces.append(joiner.join(units[first:]))
+    if markup:
+        pieces = balanceTags([piece.replace(TAG_SPACE, " ") for piece in pieces])
+    return pieces
@@ -0,0 +1,87 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import os
+from helper import FileHelper,S3Helper,S3KeyListing
+import instrumentation
+
+# Where caption files are read from and written to. Keys are "/" separated paths relative to the root of the
+# storage, the Captions parser and serializers only see streams and text so the same pipeline runs on an S3
+# bucket in Lambda and on a local directory offline. Both backends can be pickled to worker processes.
+
+
+# Objects of an S3 bucket, optionally under a prefix
+class S3Storage:
+
+    def __init__(self, bucketName, prefix=""):
+        self.bucketName = bucketName
+        self.prefix = prefix
+
+    def location(self, key):
+        return "s3://{}/{}{}".format(self.bucketName, self.prefix, key)
+
+    # Binary stream of the object, the caller closes it
+    def readStream(self, key):
+        return S3Helper.readStreamFromS3(self.bucketName, self.prefix + key)
+
+    def read(self, key):
+        return S3Helper.readFromS3(self.bucketName, self.prefix + key)
+
+    def write(self, content, key):
+        S3Helper.writeToS3(content, self.bucketName, self.prefix + key)
+
+    # Keys under prefix with one of extensions (all keys when None)
+    def listKeys(self, prefix="", extensions=None):
+        for key in S3KeyListing(self.bucketName, self.prefix + prefix, extensions):
+            yield key[len(self.prefix):]
+
+
+# Files under a local directory
+class LocalStorage:
+
+    def __init__(self, root):
+        self.root = root
+
+    def location(self, key):
+        return self.path(key)
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def readStream(self, key):
+        stream = open(self.path(key), "rb")
+        instrumentation.count("ReadBytes", os.fstat(stream.fileno()).st_size)
+        return stream
+
+    def read(self, key):
+        with self.readStream(key) as f:
+            return f.read().decode('utf-8')
+
+    def write(self, content, key):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        with open(path, "wb") as f:
+            f.write(content)
+        instrumentation.count("WrittenBytes", len(content))
+
+    # Keys of the files under prefix with one of extensions (all files when None), in sorted order
+    def listKeys(self, prefix="", extensions=None):
+        top = self.path(prefix) if prefix else self.root
+        for directory, directories, files in os.walk(top):
+            directories.sort()
+            relative = os.path.relpath(directory, self.root)
+            for name in sorted(files):
+                if extensions is None or FileHelper.getFileExtenstion(name).lower() in extensions:
+                    yield name if relative == os.curdir else "/".join(relative.split(os.sep) + [name])
+
+
+# Storage for a location given on the command line, s3://bucket/prefix/ or a local directory
+def openStorage(location):
+    if location.startswith("s3://"):
+        bucketName, _, prefix = location[len("s3://"):].partition("/")
+        if prefix and not prefix.endswith("/"):
+            prefix += "/"
+        return S3Storage(bucketName, prefix)
+    return LocalStorage(location)
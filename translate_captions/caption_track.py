@@ -0,0 +1,239 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import struct
+import sys
+from array import array
+from caption_parser import Block
+
+# Header of the timing index: magic and cue count, followed by the start and end columns as little-endian int64
+TIMING_INDEX_HEADER = struct.Struct("<4sI")
+TIMING_INDEX_MAGIC = b"CTI1"
+
+# Timestamps are formatted in batches so the serializers never hold more than this many strings at once
+FORMAT_BATCH_SIZE = 4096
+
+
+# Column store for a caption file. Cue timings are kept as integer milliseconds in
+# array('q') columns and the cue text lives in one contiguous string indexed by offsets,
+# so a track of tens of thousands of cues costs a handful of objects instead of a dict per cue.
+# The VTT attributes that are not translated are carried along for the writers: the header, the NOTE, STYLE
+# and REGION blocks ({index of the next cue: [block]}) and the cue identifiers and settings, lists created
+# with the first cue that has one (shorter than the track when the last cues have none).
+class CaptionTrack:
+
+    def __init__(self, starts=None, ends=None):
+        self.starts = array('q') if starts is None else starts
+        self.ends = array('q') if ends is None else ends
+        self.offsets = array('q', [0])
+        self.sourceTrack = None
+        self.header = None
+        self.blocks = None
+        self.identifiers = None
+        self.settings = None
+        self._buffer = ""
+        self._pending = []
+
+    # Build a track from parsed cues and blocks (see caption_parser.Cue and Block). The identifiers and settings
+    # are only kept with keepFormat, SRT files are numbered again when they are written.
+    @classmethod
+    def fromCues(cls, cues, keepFormat=True):
+        track = cls()
+        for cue in cues:
+            if cue.__class__ is Block:
+                track.addBlock(cue.text)
+                continue
+            if keepFormat and (cue.identifier or cue.settings):
+                track.setCueFormat(len(track.starts), cue.identifier, cue.settings)
+            track.append(cue.start, cue.end, cue.text)
+        return track
+
+    # Build a track holding only the timing stored by timingIndex, cue text is left empty
+    @classmethod
+    def fromTimingIndex(cls, data):
+        magic, count = TIMING_INDEX_HEADER.unpack_from(data)
+        if magic != TIMING_INDEX_MAGIC:
+            raise ValueError("Not a caption timing index")
+        columnBytes = count * 8
+        offset = TIMING_INDEX_HEADER.size
+        starts = array('q', data[offset:offset + columnBytes])
+        ends = array('q', data[offset + columnBytes:offset + 2 * columnBytes])
+        if len(starts) != count or len(ends) != count:
+            raise ValueError("Truncated caption timing index")
+        if sys.byteorder != "little":
+            starts.byteswap()
+            ends.byteswap()
+        track = cls(starts, ends)
+        track.offsets = array('q', bytes(8 * (count + 1)))
+        return track
+
+    # Compact binary index of the cue timing, persisted at submit time so the completion
+    # handler does not need to re-parse the source captions
+    def timingIndex(self):
+        starts = array('q', self.starts)
+        ends = array('q', self.ends)
+        if sys.byteorder != "little":
+            starts.byteswap()
+            ends.byteswap()
+        return TIMING_INDEX_HEADER.pack(TIMING_INDEX_MAGIC, len(starts)) + starts.tobytes() + ends.tobytes()
+
+    # Build a track with the timing and VTT attributes of this track and new text, used for translated output
+    def withTexts(self, texts):
+        track = CaptionTrack(array('q', self.starts), array('q', self.ends))
+        for text in texts:
+            track._appendText(text)
+        if len(track.offsets) - 1 != len(track.starts):
+            raise ValueError("Expected {} captions, got {}".format(len(track.starts), len(track.offsets) - 1))
+        track.sourceTrack = self
+        track.header = self.header
+        track.blocks = self.blocks
+        track.identifiers = self.identifiers
+        track.settings = self.settings
+        return track
+
+    # Add a block that is not a cue before the next cue, the first block of the file is the header
+    def addBlock(self, text):
+        if self.header is None and not self.starts and text.startswith("WEBVTT"):
+            self.header = text
+            return
+        if self.blocks is None:
+            self.blocks = {}
+        self.blocks.setdefault(len(self.starts), []).append(text)
+
+    # Set the identifier and settings of cue index, cues are set in ascending order
+    def setCueFormat(self, index, identifier, settings):
+        if identifier:
+            if self.identifiers is None:
+                self.identifiers = []
+            self.identifiers.extend([""] * (index - len(self.identifiers)))
+            self.identifiers.append(identifier)
+        if settings:
+            if self.settings is None:
+                self.settings = []
+            self.settings.extend([""] * (index - len(self.settings)))
+            self.settings.append(settings)
+
+    def identifier(self, index):
+        identifiers = self.identifiers
+        return identifiers[index] if identifiers is not None and index < len(identifiers) else ""
+
+    def cueSettings(self, index):
+        settings = self.settings
+        return settings[index] if settings is not None and index < len(settings) else ""
+
+    # The VTT attributes as a JSON-serializable dict, persisted next to the timing index, empty when there are none
+    def formatInfo(self):
+        info = {}
+        if self.header is not None:
+            info["header"] = self.header
+        if self.blocks:
+            info["blocks"] = dict((str(index), blocks) for index, blocks in self.blocks.items())
+        if self.identifiers is not None:
+            info["identifiers"] = self.identifiers
+        if self.settings is not None:
+            info["settings"] = self.settings
+        return info
+
+    def applyFormat(self, info):
+        self.header = info.get("header")
+        self.blocks = dict((int(index), blocks) for index, blocks in info["blocks"].items()) if "blocks" in info else None
+        self.identifiers = info.get("identifiers")
+        self.settings = info.get("settings")
+
+    def append(self, start, end, text):
+        self.starts.append(start)
+        self.ends.append(end)
+        self._appendText(text)
+
+    def _appendText(self, text):
+        self._pending.append(text)
+        self.offsets.append(self.offsets[-1] + len(text))
+
+    # Fold pending appends into the contiguous text buffer
+    def _compact(self):
+        if self._pending:
+            self._pending.insert(0, self._buffer)
+            self._buffer = "".join(self._pending)
+            self._pending = []
+        return self._buffer
+
+    def __len__(self):
+        return len(self.starts)
+
+    def text(self, index):
+        buffer = self._compact()
+        return buffer[self.offsets[index]:self.offsets[index + 1]]
+
+    def texts(self):
+        buffer = self._compact()
+        offsets = self.offsets
+        for i in range(len(offsets) - 1):
+            yield buffer[offsets[i]:offsets[i + 1]]
+
+
+# Format integer milliseconds as HH:MM:SS<separator>mmm (separator is "," for SRT and "." for VTT)
+def formatTimestamp(millis, separator):
+    seconds, millis = divmod(millis, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%02d:%02d:%02d%s%03d" % (hours, minutes, seconds, separator, millis)
+
+
+_millisStrings = ["%03d" % i for i in range(1000)]
+_secondStrings = ["%02d" % i for i in range(60)]
+
+
+# Format a whole column of integer milliseconds, returns a list of timestamp strings.
+# The HH:MM: prefix is cached per minute and the seconds / milliseconds parts come from lookup tables.
+def formatTimestamps(column, separator):
+    millisStrings = [separator + m for m in _millisStrings]
+    secondStrings = _secondStrings
+    minutePrefixes = {}
+    formatted = []
+    append = formatted.append
+    for millis in column:
+        seconds, millis = divmod(millis, 1000)
+        minutes, seconds = divmod(seconds, 60)
+        prefix = minutePrefixes.get(minutes)
+        if prefix is None:
+            prefix = minutePrefixes[minutes] = "%02d:%02d:" % divmod(minutes, 60)
+        append(prefix + secondStrings[seconds] + millisStrings[millis])
+    return formatted
+
+
+# Yield batches of (start, end, text) tuples with the timestamps already formatted
+def iterFormattedBatches(track, separator):
+    texts = track.texts()
+    for batch in range(0, len(track), FORMAT_BATCH_SIZE):
+        starts = formatTimestamps(track.starts[batch:batch + FORMAT_BATCH_SIZE], separator)
+        ends = formatTimestamps(track.ends[batch:batch + FORMAT_BATCH_SIZE], separator)
+        yield batch, zip(starts, ends, texts)
+
+
+# Write a track in SRT format to a text writer (StringIO, file, upload stream). VTT attributes are left out.
+def writeSRT(track, out):
+    for batch, cues in iterFormattedBatches(track, ","):
+        out.write("".join(["%d\n%s --> %s\n%s\n\n" % ((index,) + cue) for index, cue in enumerate(cues, batch + 1)]))
+
+
+# Write a track in VTT format to a text writer (StringIO, file, upload stream), with the header, blocks,
+# identifiers and settings of the track in one pass
+def writeVTT(track, out):
+    out.write((track.header or "WEBVTT") + "\n\n")
+    if track.identifiers is None and track.settings is None and not track.blocks:
+        for batch, cues in iterFormattedBatches(track, "."):
+            out.write("".join(["%s --> %s\n%s\n\n" % cue for cue in cues]))
+        return
+    blocks = track.blocks or {}
+    for batch, cues in iterFormattedBatches(track, "."):
+        parts = []
+        for index, (start, end, text) in enumerate(cues, batch):
+            for block in blocks.get(index, ()):
+                parts.append(block + "\n\n")
+            identifier = track.identifier(index)
+            settings = track.cueSettings(index)
+            parts.append("%s%s --> %s%s\n%s\n\n" % (identifier + "\n" if identifier else "", start, end,
+                                                     " " + settings if settings else "", text))
+        out.write("".join(parts))
+    for block in blocks.get(len(track), ()):
+        out.write(block + "\n\n")
@@ -0,0 +1,47 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+# Translators for running the pipeline without Amazon Translate, used by the offline CLI and the benchmarks.
+# A translator is a function (document, sourceLanguageCode, targetLanguageCode) -> document that keeps the
+# numbered caption spans and the placeholders of the delimited document.
+
+import importlib
+import re
+
+# Tags and entities of a delimited document, the text between them is what a translator changes
+MARKUP_PATTERN = re.compile(r"(<[^>]*>|&#?\w+;)")
+PSEUDO_ACCENTS = str.maketrans("aeiouAEIOUcnys", "àéîöûÀÉÎÖÛçñÿš")
+
+# Translators resolved by name, per process
+_translators = {}
+
+
+def identityTranslator(document, sourceLanguageCode, targetLanguageCode):
+    return document
+
+
+# Accented and about a third longer, like most translations out of English, so that alignment, wrapping and
+# reflow see realistic text
+def pseudoTranslator(document, sourceLanguageCode, targetLanguageCode):
+    parts = MARKUP_PATTERN.split(document)
+    return "".join(part if i % 2 else pseudoTranslate(part) for i, part in enumerate(parts))
+
+
+def pseudoTranslate(text):
+    words = text.translate(PSEUDO_ACCENTS).split(" ")
+    return " ".join(word + " " + word[:4] if i % 3 == 2 else word for i, word in enumerate(words))
+
+
+# Translator for a name: identity, pseudo, or module:function for a translator of your own
+def loadTranslator(name):
+    if name not in _translators:
+        if name == "identity":
+            _translators[name] = identityTranslator
+        elif name == "pseudo":
+            _translators[name] = pseudoTranslator
+        elif ":" in name:
+            moduleName, functionName = name.split(":", 1)
+            _translators[name] = getattr(importlib.import_module(moduleName), functionName)
+        else:
+            raise ValueError("Unknown translator {}, expected identity, pseudo or module:function".format(name))
+    return _translators[name]
@@ -1,207 +1,500 @@
 ## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 ## SPDX-License-Identifier: MIT-0
 
-import boto3
-import logging
-import math
-import html
+import hashlib
+import json
 import time
-import webvtt
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
-from helper import AwsHelper,S3Helper
-from tempfile import NamedTemporaryFile
+from botocore.exceptions import ClientError
+from helper import AwsHelper,FileHelper,S3Helper
+import instrumentation
+from caption_parser import iterItems
+from caption_storage import S3Storage
+from caption_track import CaptionTrack,formatTimestamp,writeSRT,writeVTT
+from caption_reflow import wrapText,reflowTrack
+from caption_segments import segmentCaptions,segmentText,redistributeText
+from caption_alignment import LEGACY_DELIMITER,CaptionAlignmentError,encodeCaptions,alignCaptions,splitCaptions,stripCaptionSpans
+from translation_memory import normalizeText
+
+# TranslateText accepts up to 10,000 bytes of UTF-8 text per request
+REALTIME_MAX_REQUEST_BYTES = 10000
+REALTIME_MAX_WORKERS = 8
+# A batch translation job accepts up to 10 target languages
+MAX_JOB_TARGET_LANGUAGES = 10
+# Size of a caption content hash (sha1 digest)
+CAPTION_HASH_BYTES = 20
+# Amazon Translate runs a limited number of batch jobs at once (10 by default), a job start over the limit is
+# retried with a growing delay before it fails or is left pending (see TranslateCaptions)
+JOB_START_ATTEMPTS = 4
+JOB_START_RETRY_SECONDS = 5
+JOB_START_RETRY_CODES = ('LimitExceededException', 'TooManyRequestsException', 'ThrottlingException')
+
+# Key of an intermediate file of a batch, for example captions-timing/<batch id>/<file>.timing. Every batch
+# has its own folders so concurrent batches never share files. Jobs started before batches had ids keep their
+# files at the top of the folder.
+def batchKey(folder, batchId, name):
+    if batchId:
+        return "{}/{}/{}".format(folder, batchId, name)
+    return "{}/{}".format(folder, name)
+
+# The ids of the jobs of a batch, written once they are started, and the marker the completion of each job writes
+# when its files are rebuilt. The intermediate files of a batch are removed once every job has its marker.
+def batchJobsKey(batchId):
+    return batchKey("captions-timing", batchId, "jobs.json")
+
+def batchJobDoneKey(batchId, jobId):
+    return batchKey("captions-timing", batchId, "jobs/{}.done".format(jobId))
+
+# Line length, line count and reading speed limits of the translated captions of a request (see ReflowCaptions)
+def captionLayout(request):
+    return (int(request.get("max_line_length", 0)), int(request.get("max_lines", 0)), int(request.get("max_chars_per_second", 0)))
+
+
+logger = instrumentation.getLogger(__name__)
+
 
 class Captions:
 
-    def __init__(self):
-        logging.basicConfig(level=logging.DEBUG)
-        self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.DEBUG)
-
-    def ConvertToDemilitedFiles(self,inputCaptions):
-        marker = "<span>"
-        # Convert captions to text with marker between caption lines
-        inputEntries = map(lambda c: c["caption"], inputCaptions)
-        inputDelimited = marker.join(inputEntries)
-        self.logger.debug(inputDelimited)
+    def __init__(self, translationMemory=None):
+        self.logger = logger
+        self.translationMemory = translationMemory
+
+    # cachedCaptions holds the indexes of cues that already have a translation and are left out.
+    # With segments (see SegmentCaptions) every segment is sent as one span numbered by its first caption.
+    # Inline tags are sent as placeholders, tags ({}) receives the tags of every span to put them back.
+    def ConvertToDemilitedFiles(self,inputCaptions,cachedCaptions=None,segments=None,tags=None):
+        # Convert captions to text with every caption line in a span numbered by its index
+        inputEntries = enumerate(inputCaptions.texts())
+        if segments is not None:
+            inputEntries = [(segment[0], segmentText(inputCaptions, segment)) for segment in segments]
+        elif cachedCaptions:
+            inputEntries = [(i, text) for i, text in inputEntries if i not in cachedCaptions]
+        inputDelimited = encodeCaptions(inputEntries, tags)
+        if instrumentation.logBodies(self.logger):
+            self.logger.debug(inputDelimited)
         return inputDelimited
 
-    def TranslateCaptions(self, translationContext, terminology_names=[]):
+    # Start the batch translation jobs for the delimited files in the input location.
+    # Target languages without a custom terminology share multi-target jobs, languages with a terminology
+    # get a job of their own. Jobs are submitted in parallel and a list of job info is returned.
+    # The ids of the jobs are added to started (a list) as they start, so a caller can tell whether any job of a
+    # failed call is running. With pending (a list), the target languages of every job still over the concurrent
+    # job limit after its retries are added to it instead of failing the call.
+    def TranslateCaptions(self, translationContext, terminology_names=[], started=None, pending=None):
 
-        marker = "<span>"
-        sourceLanguageCode = translationContext["sourceLang"]
         targetLanguageCodes = translationContext["targetLangList"]
-        translate_role= translationContext["roleArn"]
-        bucket = translationContext["bucket"] 
-        inputPath = translationContext["inputLocation"] 
-        outputPath= translationContext["outputlocation"]
-        jobPrefix = translationContext["jobPrefix"]
         try:
             translate_client =AwsHelper().getClient('translate')
-            targetLanguageCode = targetLanguageCodes[0]
-            self.logger.debug("Starting translation to {}".format(targetLanguageCode))
-            singletonTargetList = []
-            singletonTargetList.append(targetLanguageCode)
+            self.logger.debug("Starting translation to {}".format(targetLanguageCodes))
             millis = int(round(time.time() * 1000))
-            job_name = jobPrefix+ str(millis)
-            self.logger.debug("JobName: {}".format(job_name))
-
-            terminology_name = []
-            if len(terminology_names) > 0:
-                for item in terminology_names:
-                    if targetLanguageCode in item['TargetLanguageCodes']:
-                        terminology_name.append(item['Name'])
-                        break
-                if len(terminology_name) == 0:
-                    self.logger.debug(int("No custom terminology specified."))
+
+            jobs = []
+            sharedTargetList = []
+            for targetLanguageCode in targetLanguageCodes:
+                terminology_name = self.getTerminologyNames(terminology_names, targetLanguageCode)
+                if len(terminology_name) > 0:
+                    jobs.append(([targetLanguageCode], terminology_name))
                 else:
-                    self.logger.debug("Using custom terminology {}".format(terminology_name))
-
-            # Save the delimited transcript text to S3
-            response = translate_client.start_text_translation_job(
-                JobName=job_name,
-                InputDataConfig={
-                    'S3Uri': "s3://{}/{}".format(bucket,inputPath),
-                    'ContentType': "text/html"
-                },
-                OutputDataConfig={
-                    'S3Uri': "s3://{}/{}".format(bucket,outputPath)
-                },
-                DataAccessRoleArn=translate_role,
-                SourceLanguageCode=sourceLanguageCode,
-                TargetLanguageCodes=singletonTargetList,
-                TerminologyNames=terminology_name
-            )
-            jobinfo = {
-                "JobId": response["JobId"],
-                "TargetLanguageCode": targetLanguageCode
-            }
-            return jobinfo
+                    sharedTargetList.append(targetLanguageCode)
+            for i in range(0, len(sharedTargetList), MAX_JOB_TARGET_LANGUAGES):
+                jobs.append((sharedTargetList[i:i + MAX_JOB_TARGET_LANGUAGES], []))
+
+            def startJob(job):
+                targetList, terminology_name = job
+                job_name = "{}{}-{}".format(translationContext["jobPrefix"], millis, "-".join(targetList))
+                try:
+                    jobinfo = self.startTranslationJob(translate_client, translationContext, job_name, targetList, terminology_name)
+                except ClientError as e:
+                    if pending is None or e.response['Error']['Code'] not in JOB_START_RETRY_CODES:
+                        raise e
+                    self.logger.warning("Translation job {} not started: {}".format(job_name, e))
+                    pending.extend(targetList)
+                    return None
+                if started is not None:
+                    started.append(jobinfo["JobId"])
+                return jobinfo
+
+            with ThreadPoolExecutor(max_workers=max(1, len(jobs))) as executor:
+                return [jobinfo for jobinfo in executor.map(startJob, jobs) if jobinfo is not None]
 
         except Exception as e:
             self.logger.error(e)
             raise e
 
-    def captionsToSRT(self, captions):
-        srt = ''
-
-        index = 1
-
-        for caption in captions:
-            srt += str(index) + '\n'
-            srt += self.formatTimeSRT(float(caption["start"])) + ' --> ' + self.formatTimeSRT(float(caption["end"])) + '\n'
-            srt += caption["caption"] + '\n\n'
-            index += 1
+    # Start a single batch translation job of the delimited files, retried while the account is over its
+    # concurrent job limit
+    def startTranslationJob(self, translate_client, translationContext, job_name, targetLanguageCodes, terminology_name):
+        bucket = translationContext["bucket"]
+        self.logger.debug("JobName: {}".format(job_name))
+        for attempt in range(JOB_START_ATTEMPTS):
+            try:
+                response = translate_client.start_text_translation_job(
+                    JobName=job_name,
+                    InputDataConfig={
+                        'S3Uri': "s3://{}/{}".format(bucket,translationContext["inputLocation"]),
+                        'ContentType': "text/html"
+                    },
+                    OutputDataConfig={
+                        'S3Uri': "s3://{}/{}".format(bucket,translationContext["outputlocation"])
+                    },
+                    DataAccessRoleArn=translationContext["roleArn"],
+                    SourceLanguageCode=translationContext["sourceLang"],
+                    TargetLanguageCodes=targetLanguageCodes,
+                    TerminologyNames=terminology_name
+                )
+                break
+            except ClientError as e:
+                if e.response['Error']['Code'] not in JOB_START_RETRY_CODES or attempt == JOB_START_ATTEMPTS - 1:
+                    raise e
+                self.logger.warning("Translation job {} not started ({}), retrying".format(job_name, e.response['Error']['Code']))
+                instrumentation.count("TranslationJobRetries")
+                time.sleep(JOB_START_RETRY_SECONDS * 2 ** attempt)
+        instrumentation.count("TranslationJobs")
+        jobinfo = {
+            "JobId": response["JobId"],
+            "TargetLanguageCodes": targetLanguageCodes
+        }
+        return jobinfo
+
+    # Pick the first custom terminology that supports the target language
+    def getTerminologyNames(self, terminology_names, targetLanguageCode):
+        terminology_name = []
+        if len(terminology_names) > 0:
+            for item in terminology_names:
+                if targetLanguageCode in item['TargetLanguageCodes']:
+                    terminology_name.append(item['Name'])
+                    break
+            if len(terminology_name) == 0:
+                self.logger.debug("No custom terminology specified.")
+            else:
+                self.logger.debug("Using custom terminology {}".format(terminology_name))
+        return terminology_name
+
+    # Translate a caption track with the synchronous TranslateText API, used for short caption files.
+    # Cue text is packed into requests of up to maxRequestBytes that run on a bounded thread pool.
+    # Cues already looked up in the translation memory can be passed as cachedCaptions ({index: text}).
+    def TranslateCaptionsRealtime(self, captions, sourceLanguageCode, targetLanguageCode, terminology_names=[],
+                                  translate_client=None, maxWorkers=REALTIME_MAX_WORKERS, maxRequestBytes=REALTIME_MAX_REQUEST_BYTES,
+                                  cachedCaptions=None, segmentWeighting=None):
+        if translate_client is None:
+            translate_client = AwsHelper().getClient('translate')
+        terminology_name = self.getTerminologyNames(terminology_names, targetLanguageCode)
+        sourceTexts = list(captions.texts())
+        cached = cachedCaptions or {}
+        if cachedCaptions is None and self.translationMemory is not None:
+            cached = self.lookupCachedCaptions(captions, sourceLanguageCode, [targetLanguageCode], terminology_names,
+                                               segmentWeighting)[targetLanguageCode]
+        segments = None
+        weights = None
+        if segmentWeighting:
+            segments = self.SegmentCaptions(captions, cached)
+            weights = self.segmentWeights(captions, segmentWeighting)
+            sourceCaptions = dict((segment[0], segmentText(captions, segment)) for segment in segments)
+        else:
+            sourceCaptions = dict((i, text) for i, text in enumerate(sourceTexts) if i not in cached)
+        translated = self.TranslateCaptionIndexes(sourceCaptions, sorted(sourceCaptions), sourceLanguageCode, targetLanguageCode,
+                                                  terminology_name, translate_client, maxWorkers, maxRequestBytes)
+        if self.translationMemory is not None:
+            self.translationMemory.store(list(sourceCaptions.values()), [translated[i] for i in sourceCaptions],
+                                         sourceLanguageCode, targetLanguageCode, terminology_name)
+        return self.ApplyTranslatedCaptions(captions, translated, cached, 0, segments, weights)
+
+    # Group the captions not found in cachedCaptions into sentence segments, lists of consecutive caption indexes
+    def SegmentCaptions(self, captions, cachedCaptions=None):
+        cachedCaptions = cachedCaptions or {}
+        return segmentCaptions(captions, [i for i in range(len(captions)) if i not in cachedCaptions])
+
+    # Weight of every caption when a translated segment is spread over its captions: the source text length
+    # ("length", lengths can be given when the track has no text) or the caption duration ("timing")
+    def segmentWeights(self, captions, segmentWeighting, lengths=None):
+        if segmentWeighting == "timing":
+            return [end - start for start, end in zip(captions.starts, captions.ends)]
+        if lengths is not None:
+            return lengths
+        return [len(text) for text in captions.texts()]
+
+    # Translate the captions of sourceCaptions ({index: text}) listed in indexes with TranslateText,
+    # returns {index: translation}. Also used to re-request the captions a batch job misaligned.
+    def TranslateCaptionIndexes(self, sourceCaptions, indexes, sourceLanguageCode, targetLanguageCode, terminology_name=[],
+                                translate_client=None, maxWorkers=REALTIME_MAX_WORKERS, maxRequestBytes=REALTIME_MAX_REQUEST_BYTES):
+        if translate_client is None:
+            translate_client = AwsHelper().getClient('translate')
+        spans = [encodeCaptions([(i, sourceCaptions[i])]) for i in indexes]
+        batches = self.packCaptions(spans, maxRequestBytes)
+        self.logger.debug("Translating {} captions in {} requests to {}".format(len(indexes), len(batches), targetLanguageCode))
+
+        def translateBatch(batch):
+            return self.translateRealtimeBatch(translate_client, [(i, sourceCaptions[i]) for i in indexes[batch[0]:batch[1]]],
+                                               sourceLanguageCode, targetLanguageCode, terminology_name)
+
+        translated = {}
+        with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+            for entries in executor.map(translateBatch, batches):
+                translated.update(entries)
+        return translated
+
+    # Look up the cue text in the translation memory for every target language. In segment mode the memory holds
+    # the translations of whole segments, the segments of the track are looked up and a segment found is spread
+    # over its captions like a translated segment (see ApplyTranslatedCaptions).
+    # Returns {targetLanguageCode: {index: translation}} with the cues cached in each language.
+    def lookupCachedCaptions(self, captions, sourceLanguageCode, targetLanguageCodes, terminology_names=[], segmentWeighting=None):
+        if self.translationMemory is None:
+            return {}
+        segments = None
+        if segmentWeighting:
+            segments = self.SegmentCaptions(captions)
+            texts = [segmentText(captions, segment) for segment in segments]
+            weights = self.segmentWeights(captions, segmentWeighting)
+        else:
+            texts = list(captions.texts())
+        found = {}
+        for targetLanguageCode in targetLanguageCodes:
+            terminology_name = self.getTerminologyNames(terminology_names, targetLanguageCode)
+            hits = self.translationMemory.lookup(texts, sourceLanguageCode, targetLanguageCode, terminology_name)
+            if segments is not None:
+                cached = {}
+                for position, translation in hits.items():
+                    segment = segments[position]
+                    cached.update(zip(segment, redistributeText(translation, [weights[i] for i in segment])))
+                hits = cached
+            found[targetLanguageCode] = hits
+        return found
+
+    # Add translations of a batch job to the translation memory. sourceCaptions ({index: text}) are the
+    # caption or segment texts that were sent in the delimited file, translations their aligned translations.
+    def storeTranslatedCaptions(self, sourceCaptions, translations, sourceLanguageCode, targetLanguageCode,
+                                terminology_names=[]):
+        if self.translationMemory is None or targetLanguageCode is None:
+            return
+        indexes = [i for i in sorted(sourceCaptions) if i in translations]
+        terminology_name = self.getTerminologyNames(terminology_names, targetLanguageCode)
+        self.translationMemory.store([sourceCaptions[i] for i in indexes], [translations[i] for i in indexes],
+                                     sourceLanguageCode, targetLanguageCode, terminology_name)
+
+    # Content hash of every caption of a track, captions with the same text have the same hash wherever they are
+    def captionHashes(self, captions):
+        return [hashlib.sha1(normalizeText(text).encode("utf-8")).digest() for text in captions.texts()]
+
+    def packCaptionHashes(self, hashes):
+        return b"".join(hashes)
+
+    def unpackCaptionHashes(self, data):
+        return [bytes(data[i:i + CAPTION_HASH_BYTES]) for i in range(0, len(data), CAPTION_HASH_BYTES)]
+
+    # Translations of the previous submission of a caption file for the captions whose text did not change, as
+    # {targetLanguageCode: {index: text}}. The captions are matched by content hash so inserted, removed or
+    # re-timed captions do not invalidate the rest of the file.
+    def lookupRevisionCaptions(self, bucketName, fileName, hashes, sourceLanguageCode, targetLanguageCodes):
+        found = {}
+        for targetLanguageCode in targetLanguageCodes:
+            revision = self.readRevision(bucketName, fileName, sourceLanguageCode, targetLanguageCode)
+            found[targetLanguageCode] = dict((i, revision[h.hex()]) for i, h in enumerate(hashes) if h.hex() in revision)
+        return found
+
+    # Translations of the last submission of fileName into targetLanguageCode, {caption hash: text}
+    def readRevision(self, bucketName, fileName, sourceLanguageCode, targetLanguageCode):
+        try:
+            revision = json.loads(S3Helper().readFromS3(bucketName, "captions-revisions/{}.{}.json".format(targetLanguageCode, fileName)))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return {}
+            raise e
+        if revision.get("sourceLanguage") != sourceLanguageCode:
+            return {}
+        return revision["captions"]
+
+    # Keep the translated captions of this submission so the next upload of the file only translates what changed
+    def storeRevision(self, bucketName, fileName, hashes, translatedCaptions, sourceLanguageCode, targetLanguageCode):
+        if hashes is None or targetLanguageCode is None or len(hashes) != len(translatedCaptions):
+            return
+        revision = {
+            "sourceLanguage": sourceLanguageCode,
+            "captions": dict(zip((h.hex() for h in hashes), translatedCaptions.texts()))
+        }
+        S3Helper().writeToS3(json.dumps(revision), bucketName, "captions-revisions/{}.{}.json".format(targetLanguageCode, fileName))
+
+    # Union of {targetLanguageCode: {index: text}} lookups
+    def combineCachedCaptions(self, *lookups):
+        combined = {}
+        for cachedCaptions in lookups:
+            for targetLanguageCode, entries in cachedCaptions.items():
+                combined.setdefault(targetLanguageCode, {}).update(entries)
+        return combined
+
+    # The cached captions known in every target language, only those can be left out of a multi-target batch job
+    def commonCachedCaptions(self, cachedCaptions, targetLanguageCodes):
+        common = None
+        for targetLanguageCode in targetLanguageCodes:
+            known = set(cachedCaptions.get(targetLanguageCode, {}))
+            common = known if common is None else common & known
+        if not common:
+            return {}
+        return dict((code, dict((i, cachedCaptions[code][i]) for i in common)) for code in targetLanguageCodes)
+
+    # Split encoded caption spans into (start, end) index ranges whose joined text stays within maxRequestBytes
+    def packCaptions(self, spans, maxRequestBytes):
+        batches = []
+        start = 0
+        size = 0
+        for i, span in enumerate(spans):
+            spanBytes = len(span.encode('utf-8'))
+            if i > start and size + spanBytes > maxRequestBytes:
+                batches.append((start, i))
+                start = i
+                size = 0
+            size += spanBytes
+        if start < len(spans):
+            batches.append((start, len(spans)))
+        return batches
+
+    # Split a delimited file at caption boundaries into shards of at most maxShardBytes
+    def ShardDelimitedFile(self, delimitedFile, maxShardBytes):
+        spans = splitCaptions(delimitedFile)
+        return ["".join(spans[start:end]) for start, end in self.packCaptions(spans, maxShardBytes)]
+
+    # Translate one packed request of (index, text) entries, returns {index: translation}. Captions whose
+    # span Translate dropped or merged, and their neighbours, are sent again one by one.
+    def translateRealtimeBatch(self, translate_client, entries, sourceLanguageCode, targetLanguageCode, terminology_name):
+        if not any(text.strip() for i, text in entries):
+            return dict(entries)
+        tags = {}
+        text = encodeCaptions(entries, tags)
+        response = translate_client.translate_text(
+            Text=text,
+            SourceLanguageCode=sourceLanguageCode,
+            TargetLanguageCode=targetLanguageCode,
+            TerminologyNames=terminology_name
+        )
+        instrumentation.count("TranslateTextRequests")
+        instrumentation.count("TranslateTextCharacters", len(text))
+        expected = [i for i, text in entries]
+        translated, misaligned = alignCaptions(response['TranslatedText'], expected, tags=tags)
+        if not misaligned:
+            return dict((i, translated[i]) for i in expected)
+        if len(entries) == 1:
+            return {expected[0]: stripCaptionSpans(response['TranslatedText'], tags.get(expected[0]))}
+        self.logger.warning("{} of {} captions misaligned in the translated request, translating them individually"
+                            .format(len(misaligned), len(entries)))
+        sourceCaptions = dict(entries)
+        for i in misaligned:
+            translated.update(self.translateRealtimeBatch(translate_client, [(i, sourceCaptions[i])], sourceLanguageCode,
+                                                          targetLanguageCode, terminology_name))
+        return dict((i, translated[i]) for i in expected)
+
+    # Serialize a track in captionFormat (vtt or srt)
+    def serializeCaptions(self, captions, captionFormat):
+        if captionFormat.lower() == "vtt":
+            return self.captionsToVTT(captions)
+        return self.captionsToSRT(captions)
 
-        return srt.rstrip()
+    def captionsToSRT(self, captions):
+        srt = StringIO()
+        writeSRT(captions, srt)
+        return srt.getvalue().rstrip()
 
     def captionsToVTT(self, captions):
-        vtt = 'WEBVTT\n\n'
-
-        for caption in captions:
-            vtt += self.formatTimeVTT(float(caption["start"])) + ' --> ' + self.formatTimeVTT(float(caption["end"])) + '\n'
-            vtt += caption["caption"] + '\n\n'
-
-        return vtt.rstrip()
-
-    # Converts a delimited file back to web captions format.
-    # Uses the source web captions to get timestamps and source caption text (saved in sourceCaption field).
-    def DelimitedToWebCaptions(self, sourceWebCaptions, delimitedCaptions, delimiter, maxCaptionLineLength):
-
-        delimitedCaptions = html.unescape(delimitedCaptions)
-
-        entries = delimitedCaptions.split(delimiter)
-
-        outputWebCaptions = []
-        for i, c in enumerate(sourceWebCaptions):
-            caption = {}
-            caption["start"] = c["start"]
-            caption["end"] = c["end"]
-            caption["caption"] = entries[i]
-            caption["sourceCaption"] = c["caption"]
-            outputWebCaptions.append(caption)
+        vtt = StringIO()
+        writeVTT(captions, vtt)
+        return vtt.getvalue().rstrip()
+
+    # Match a translated delimited file back to the expected span indexes, returns {index: text}. The indexes are
+    # checked in one pass; misaligned spans are re-requested through recover(indexes) -> {index: text}
+    # when given, otherwise CaptionAlignmentError is raised. The inline tags of the spans (see
+    # ConvertToDemilitedFiles) are put back.
+    def AlignTranslatedCaptions(self, delimitedCaptions, expected, delimiter, recover=None, tags=None):
+        translated, misaligned = alignCaptions(delimitedCaptions, expected, delimiter, tags=tags)
+        if misaligned:
+            instrumentation.count("MisalignedCaptions", len(misaligned))
+            if recover is None:
+                raise CaptionAlignmentError("{} of {} captions misaligned in the translated file".format(len(misaligned), len(expected)))
+            self.logger.warning("{} of {} captions misaligned in the translated file, translating them again"
+                                .format(len(misaligned), len(expected)))
+            translated.update(recover(misaligned))
+        return translated
+
+    # Build the translated track from the translations of the captions ({index: text}), or of the segments keyed
+    # by their first caption, spread over the captions of each segment in proportion to weights, and the cached
+    # captions. Captions are wrapped to maxCaptionLineLength characters.
+    def ApplyTranslatedCaptions(self, sourceWebCaptions, translations, cachedCaptions=None, maxCaptionLineLength=0,
+                                segments=None, weights=None):
+        translated = dict(cachedCaptions or {})
+        if segments is not None:
+            for segment in segments:
+                pieces = redistributeText(translations[segment[0]], [weights[i] for i in segment])
+                translated.update(zip(segment, pieces))
+        else:
+            translated.update(translations)
+        texts = [translated[i] for i in range(len(sourceWebCaptions))]
+        if maxCaptionLineLength > 0:
+            texts = ["\n".join(wrapText(text, maxCaptionLineLength)) for text in texts]
+        return sourceWebCaptions.withTexts(texts)
+
+    # Wrap the captions to maxLineLength characters and, with maxLines or maxCharsPerSecond, split and merge
+    # captions to respect the number of lines and the reading speed. Returns a new track (see caption_reflow).
+    def ReflowCaptions(self, captions, maxLineLength, maxLines=0, maxCharsPerSecond=0):
+        if maxLineLength <= 0 and maxLines <= 0 and maxCharsPerSecond <= 0:
+            return captions
+        return reflowTrack(captions, maxLineLength, maxLines, maxCharsPerSecond)
+
+    # Rebuild a translated caption file from a translated delimited file, the sequence shared by the job completion
+    # and the offline CLI: align the spans (see AlignTranslatedCaptions), add the translations of sourceCaptions to
+    # the translation memory, put them in place of the source text (see ApplyTranslatedCaptions) and finish the
+    # track (see FinishTranslatedCaptions). Returns the serialized file and its cue count.
+    def ReassembleCaptions(self, sourceWebCaptions, delimitedCaptions, expected, captionFormat, layout, sourceCaptions=None,
+                           sourceLanguageCode=None, targetLanguageCode=None, cachedCaptions=None, recover=None, segments=None,
+                           weights=None, tags=None, storeRevision=None):
+        with instrumentation.timer("Reassemble"):
+            translations = self.AlignTranslatedCaptions(delimitedCaptions, expected, LEGACY_DELIMITER, recover, tags)
+            if sourceCaptions:
+                self.storeTranslatedCaptions(sourceCaptions, translations, sourceLanguageCode, targetLanguageCode)
+            translatedCaptions = self.ApplyTranslatedCaptions(sourceWebCaptions, translations, cachedCaptions, 0, segments, weights)
+        return self.FinishTranslatedCaptions(translatedCaptions, captionFormat, layout, storeRevision)
+
+    # Turn a translated track into the output file, shared by every path: keep the unwrapped track as a revision
+    # through storeRevision(track) when given, wrap, split and merge it to layout (maxLineLength, maxLines and
+    # maxCharsPerSecond, see ReflowCaptions) and serialize it in captionFormat. Returns the serialized file and
+    # its cue count.
+    def FinishTranslatedCaptions(self, translatedCaptions, captionFormat, layout, storeRevision=None):
+        if storeRevision is not None:
+            with instrumentation.timer("Upload"):
+                storeRevision(translatedCaptions)
+        with instrumentation.timer("Reflow"):
+            translatedCaptions = self.ReflowCaptions(translatedCaptions, *layout)
+        with instrumentation.timer("Serialize"):
+            return self.serializeCaptions(translatedCaptions, captionFormat), len(translatedCaptions)
+
+    # Parse a VTT or SRT stream (bytes, str or anything with read()) into a caption track, VTT files keep their
+    # header, blocks, cue identifiers and settings. The body is streamed while it is parsed, parse time includes the download.
+    def parseCaptions(self, stream, captionFormat):
+        with instrumentation.timer("Parse"):
+            return CaptionTrack.fromCues(iterItems(stream, captionFormat), captionFormat.lower() == "vtt")
+
+    # Read and parse the caption file key of a storage (see caption_storage), the format comes from the extension
+    def loadCaptions(self, storage, key):
+        self.logger.debug("Getting data from {}".format(storage.location(key)))
+        with instrumentation.timer("Fetch"):
+            stream = storage.readStream(key)
+        try:
+            return self.parseCaptions(stream, FileHelper.getFileExtenstion(key))
+        finally:
+            stream.close()
 
-        return outputWebCaptions
-    
     # Convert VTT to WebCaptions
     def vttToCaptions(self, vttObject):
+        return self.loadCaptions(S3Storage(vttObject["Bucket"]), vttObject["Key"])
 
-        captions = []
-        vtt = ""
-        # Get metadata
-        s3 = boto3.client('s3')
-        try:
-            self.logger.debug("Getting data from s3://"+vttObject["Bucket"]+"/"+vttObject["Key"])
-            vtt = S3Helper().readFromS3(vttObject["Bucket"], vttObject["Key"])
-            self.logger.debug(vtt)
-        except Exception as e:
-            #Fix me
-             self.logger.error(e)
-
-        buffer = StringIO(vtt)
-
-        for vttcaption in webvtt.read_buffer(buffer):
-            caption = {}
-            caption["start"] = self.formatTimeVTTtoSeconds(vttcaption.start)
-            caption["end"] = self.formatTimeVTTtoSeconds(vttcaption.end)
-            caption["caption"] = vttcaption.text
-            captions.append(caption)
-
-        return captions
-    # Convert VTT to WebCaptions
+    # Convert SRT to WebCaptions
     def srtToCaptions(self, vttObject):
-
-        captions = []
-        srt = ""
-        # Get metadata
-        s3 = boto3.client('s3')
-        try:
-            self.logger.debug("Getting data from s3://"+vttObject["Bucket"]+"/"+vttObject["Key"])
-            srt = S3Helper().readFromS3(vttObject["Bucket"], vttObject["Key"])
-            self.logger.debug(srt)
-        except Exception as e:
-            raise e
-        #buffer = StringIO(srt)
-        f = NamedTemporaryFile(mode='w+', delete=False)
-        f.write(srt)
-        f.close()
-        for srtcaption in webvtt.from_srt(f.name):
-            caption = {}
-            self.logger.debug(srtcaption)
-            caption["start"] = self.formatTimeVTTtoSeconds(srtcaption.start)
-            caption["end"] = self.formatTimeVTTtoSeconds(srtcaption.end)
-            caption["caption"] = srtcaption.text
-            self.logger.debug("Caption Object:{}".format(caption))
-            captions.append(caption)
-
-        return captions
+        return self.loadCaptions(S3Storage(vttObject["Bucket"]), vttObject["Key"])
 
     # Format an SRT timestamp in HH:MM:SS,mmm
     def formatTimeSRT(self, timeSeconds):
-        ONE_HOUR = 60 * 60
-        ONE_MINUTE = 60
-        hours = math.floor(timeSeconds / ONE_HOUR)
-        remainder = timeSeconds - (hours * ONE_HOUR)
-        minutes = math.floor(remainder / 60)
-        remainder = remainder - (minutes * ONE_MINUTE)
-        seconds = math.floor(remainder)
-        remainder = remainder - seconds
-        millis = remainder
-        return str(hours).zfill(2) + ':' + str(minutes).zfill(2) + ':' + str(seconds).zfill(2) + ',' + str(math.floor(millis * 1000)).zfill(3)
+        return formatTimestamp(int(round(float(timeSeconds) * 1000)), ',')
 
     # Format a VTT timestamp in HH:MM:SS.mmm
     def formatTimeVTT(self, timeSeconds):
-        ONE_HOUR = 60 * 60
-        ONE_MINUTE = 60
-        hours = math.floor(timeSeconds / ONE_HOUR)
-        remainder = timeSeconds - (hours * ONE_HOUR)
-        minutes = math.floor(remainder / 60)
-        remainder = remainder - (minutes * ONE_MINUTE)
-        seconds = math.floor(remainder)
-        remainder = remainder - seconds
-        millis = remainder
-        return str(hours).zfill(2) + ':' + str(minutes).zfill(2) + ':' + str(seconds).zfill(2) + '.' + str(math.floor(millis * 1000)).zfill(3)
-
+        return formatTimestamp(int(round(float(timeSeconds) * 1000)), '.')
 
     # Format a VTT timestamp in HH:MM:SS.mmm
     def formatTimeVTTtoSeconds(self,timeHMSf):
@@ -1,40 +1,102 @@
 ## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 ## SPDX-License-Identifier: MIT-0
 
-import boto3
-from botocore.client import Config
+from botocore.exceptions import ClientError, ParamValidationError
+from concurrent.futures import ThreadPoolExecutor
 import os
 import io
+import threading
+import instrumentation
+
+# Size of the HTTP connection pool of the cached clients, shared by the worker threads of the handlers
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '50'))
+# DeleteObjects accepts up to 1000 keys per request
+DELETE_OBJECTS_BATCH_SIZE = 1000
+# Objects larger than this are copied with multipart copy (CopyObject is limited to 5 GB)
+MULTIPART_COPY_THRESHOLD = 64 * 1024 * 1024
+MOVE_OBJECTS_MAX_WORKERS = 16
+# Parts copied at the same time by the shared transfer manager
+MULTIPART_COPY_CONCURRENCY = 10
+
+
+# Clients are thread safe and shared by every thread, resources are not and are cached per thread.
+# Both live at module level so warm Lambda invocations reuse the connections of earlier invocations.
+# boto3 and botocore.client make up most of the import time of the functions, they are imported with the first
+# client so code that never calls AWS (the offline CLI, events that are filtered out) does not load them.
+_clients = {}
+_clientsLock = threading.Lock()
+_threadResources = threading.local()
+_transferManagers = {}
+
+
+# Transfer manager of a client, shared by the multipart copies of every thread. Created with the first large copy.
+def getTransferManager(s3client):
+    manager = _transferManagers.get(s3client)
+    if manager is None:
+        with _clientsLock:
+            manager = _transferManagers.get(s3client)
+            if manager is None:
+                from boto3.s3.transfer import TransferConfig,create_transfer_manager
+                manager = create_transfer_manager(s3client, TransferConfig(multipart_threshold=MULTIPART_COPY_THRESHOLD,
+                                                                           max_concurrency=MULTIPART_COPY_CONCURRENCY))
+                _transferManagers[s3client] = manager
+    return manager
 
 
 class AwsHelper:
-    def getClient(self, name, awsRegion=None):
-        config = Config(
+    def getConfig(self, maxPoolConnections=None):
+        from botocore.client import Config
+        return Config(
             retries = dict(
                 max_attempts = 6
-            )
+            ),
+            max_pool_connections = maxPoolConnections or MAX_POOL_CONNECTIONS
         )
-        if(awsRegion):
-            return boto3.client(name, region_name=awsRegion, config=config)
-        else:
-            return boto3.client(name, config=config)
 
-    def getResource(self, name, awsRegion=None):
-        config = Config(
-            retries = dict(
-                max_attempts = 6
-            )
-        )
+    def getClient(self, name, awsRegion=None, maxPoolConnections=None):
+        key = (name, awsRegion, maxPoolConnections or MAX_POOL_CONNECTIONS)
+        client = _clients.get(key)
+        if client is None:
+            with _clientsLock:
+                client = _clients.get(key)
+                if client is None:
+                    import boto3
+                    config = self.getConfig(maxPoolConnections)
+                    if(awsRegion):
+                        client = boto3.client(name, region_name=awsRegion, config=config)
+                    else:
+                        client = boto3.client(name, config=config)
+                    _clients[key] = client
+        return client
 
-        if(awsRegion):
-            return boto3.resource(name, region_name=awsRegion, config=config)
-        else:
-            return boto3.resource(name, config=config)
+    def getResource(self, name, awsRegion=None, maxPoolConnections=None):
+        key = (name, awsRegion, maxPoolConnections or MAX_POOL_CONNECTIONS)
+        resources = getattr(_threadResources, "resources", None)
+        if resources is None:
+            resources = _threadResources.resources = {}
+        resource = resources.get(key)
+        if resource is None:
+            import boto3
+            config = self.getConfig(maxPoolConnections)
+            if(awsRegion):
+                resource = boto3.resource(name, region_name=awsRegion, config=config)
+            else:
+                resource = boto3.resource(name, config=config)
+            resources[key] = resource
+        return resource
+
+# Create the named clients during the init phase of a Lambda container, when the handler module is imported. Init
+# runs before the first event with the full CPU of the container, so the first event does not pay for loading
+# boto3 and the service models. Outside Lambda the clients stay lazy.
+def initClients(*names):
+    if os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+        for name in names:
+            AwsHelper().getClient(name)
 
 class S3Helper:
     @staticmethod
     def getS3BucketRegion(bucketName):
-        client = boto3.client('s3')
+        client = AwsHelper().getClient('s3')
         response = client.get_bucket_location(Bucket=bucketName)
         awsRegion = response['LocationConstraint']
         return awsRegion
@@ -66,53 +128,212 @@ class S3Helper:
             else:
                 hasMoreContent = False
 
-            for doc in listObjectsResponse['Contents']:
+            instrumentation.count("S3ListObjects")
+            for doc in listObjectsResponse.get('Contents', []):
                 docName = doc['Key']
                 docExt = FileHelper.getFileExtenstion(docName)
                 docExtLower = docExt.lower()
                 if(docExtLower in allowedFileTypes):
                     files.append(docName)
+            currentPage += 1
 
         return files
     @staticmethod
     def getFilteredFileNames(bucketName, prefix, extensions, awsRegion=None):
-        files = []
-        s3client = AwsHelper().getResource('s3', awsRegion)
-        bucket = s3client.Bucket(bucketName)
-        objs = bucket.objects.filter(Prefix=prefix)
-        for obj in objs:
-            docName = obj.key
-            docExt = FileHelper.getFileExtenstion(docName)
-            docExtLower = docExt.lower()
-            print("Key:{}".format(docName))
-            if (docExtLower in extensions):
-               files.append(docName)
-        return files
+        return list(S3Helper.iterFileNames(bucketName, prefix, extensions, awsRegion))
+
+    # Yield the keys under a prefix page by page as the listing arrives, optionally only the given extensions
+    @staticmethod
+    def iterFileNames(bucketName, prefix, extensions=None, awsRegion=None):
+        return iter(S3KeyListing(bucketName, prefix, extensions, awsRegion=awsRegion))
 
     @staticmethod
     def writeToS3(content, bucketName, s3FileName, awsRegion=None):
-        s3 = AwsHelper().getResource('s3', awsRegion)
-        object = s3.Object(bucketName, s3FileName)
-        object.put(Body=content)
+        s3client = AwsHelper().getClient('s3', awsRegion)
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        s3client.put_object(Bucket=bucketName, Key=s3FileName, Body=content)
+        instrumentation.count("S3PutObject")
+        instrumentation.count("WrittenBytes", len(content))
+
+    # Write an object only if the key does not exist yet, with an S3 conditional write. Returns False when the
+    # object already exists. SDKs without conditional writes fall back to a check then a write, which is not atomic.
+    @staticmethod
+    def createObject(content, bucketName, s3FileName, awsRegion=None):
+        s3client = AwsHelper().getClient('s3', awsRegion)
+        try:
+            s3client.put_object(Bucket=bucketName, Key=s3FileName, Body=content, IfNoneMatch='*')
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                return False
+            raise e
+        except ParamValidationError:
+            if S3Helper.objectExists(bucketName, s3FileName, awsRegion):
+                return False
+            s3client.put_object(Bucket=bucketName, Key=s3FileName, Body=content)
+        instrumentation.count("S3PutObject")
+        return True
+
+    # True when the key exists, checked with a HeadObject request
+    @staticmethod
+    def objectExists(bucketName, s3FileName, awsRegion=None):
+        s3client = AwsHelper().getClient('s3', awsRegion)
+        instrumentation.count("S3HeadObject")
+        try:
+            s3client.head_object(Bucket=bucketName, Key=s3FileName)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+                raise e
+            return False
+        return True
 
     @staticmethod
     def readFromS3(bucketName, s3FileName, awsRegion=None):
-        s3 = AwsHelper().getResource('s3', awsRegion)
-        obj = s3.Object(bucketName, s3FileName)
-        return obj.get()['Body'].read().decode('utf-8')
+        return S3Helper.readStreamFromS3(bucketName, s3FileName, awsRegion).read().decode('utf-8')
+
+    @staticmethod
+    def readStreamFromS3(bucketName, s3FileName, awsRegion=None):
+        s3client = AwsHelper().getClient('s3', awsRegion)
+        response = s3client.get_object(Bucket=bucketName, Key=s3FileName)
+        instrumentation.count("S3GetObject")
+        instrumentation.count("ReadBytes", response.get('ContentLength', 0))
+        return response['Body']
     
     @staticmethod
     def deleteObject(bucketName, s3FileName, awsRegion=None):
-        s3 = AwsHelper().getResource('s3', awsRegion)
-        obj = s3.Object(bucketName, s3FileName)
-        return obj.delete()
+        s3client = AwsHelper().getClient('s3', awsRegion)
+        instrumentation.count("S3DeleteObject")
+        return s3client.delete_object(Bucket=bucketName, Key=s3FileName)
+
+    # Delete keys with the DeleteObjects API, up to 1000 keys per request. s3FileNames can be a
+    # generator, keys are sent as soon as a batch is full.
+    # Returns a list of (key, error message) for the keys that could not be deleted.
+    @staticmethod
+    def deleteObjects(bucketName, s3FileNames, awsRegion=None):
+        s3client = AwsHelper().getClient('s3', awsRegion)
+        errors = []
+
+        def deleteBatch(batch):
+            response = s3client.delete_objects(
+                Bucket=bucketName,
+                Delete={
+                    'Objects': [{'Key': key} for key in batch],
+                    'Quiet': True
+                })
+            instrumentation.count("S3DeleteObjects")
+            for error in response.get('Errors', []):
+                errors.append((error['Key'], error.get('Message', error.get('Code'))))
+
+        batch = []
+        for key in s3FileNames:
+            batch.append(key)
+            if len(batch) == DELETE_OBJECTS_BATCH_SIZE:
+                deleteBatch(batch)
+                batch = []
+        if batch:
+            deleteBatch(batch)
+        return errors
+
+    # Copy objects within the bucket with concurrent server side copies. copies is a list of (current, newObject)
+    # or (current, newObject, size) keys. Objects below MULTIPART_COPY_THRESHOLD, and objects of unknown size, take
+    # one CopyObject call; larger objects are copied in parts by the transfer manager of the client.
+    # Returns the list of copied keys and a list of (key, error message) for the objects that could not be copied.
+    @staticmethod
+    def copyObjects(bucketName, copies, maxWorkers=MOVE_OBJECTS_MAX_WORKERS, awsRegion=None):
+        s3client = AwsHelper().getClient('s3', awsRegion)
+
+        def multipartCopy(current, newObject):
+            getTransferManager(s3client).copy({'Bucket': bucketName, 'Key': current}, bucketName, newObject).result()
+
+        def copy(entry):
+            current, newObject = entry[0], entry[1]
+            size = entry[2] if len(entry) > 2 else None
+            try:
+                if size is not None and size >= MULTIPART_COPY_THRESHOLD:
+                    multipartCopy(current, newObject)
+                else:
+                    try:
+                        s3client.copy_object(Bucket=bucketName, Key=newObject, CopySource={'Bucket': bucketName, 'Key': current})
+                    except ClientError as e:
+                        #objects of unknown size over the 5 GB limit of CopyObject
+                        if size is not None or e.response['Error']['Code'] != 'InvalidRequest':
+                            raise e
+                        multipartCopy(current, newObject)
+                instrumentation.count("S3CopyObject")
+                return current, None
+            except ClientError as e:
+                return current, str(e)
+
+        errors = []
+        copied = []
+        with ThreadPoolExecutor(max_workers=max(1, maxWorkers)) as executor:
+            for current, error in executor.map(copy, copies):
+                if error is None:
+                    copied.append(current)
+                else:
+                    errors.append((current, error))
+        return copied, errors
+
+    # Move objects within the bucket: concurrent copies (see copyObjects), then a bulk delete of the sources.
+    # moves is a list of (current, newObject) or (current, newObject, size) keys.
+    # Returns a list of (key, error message) for the objects that could not be moved.
+    @staticmethod
+    def moveObjects(bucketName, moves, maxWorkers=MOVE_OBJECTS_MAX_WORKERS, awsRegion=None):
+        copied, errors = S3Helper.copyObjects(bucketName, moves, maxWorkers, awsRegion)
+        errors.extend(S3Helper.deleteObjects(bucketName, copied, awsRegion))
+        return errors
 
     @staticmethod
     def renameObject(bucketName, current, newObject, awsRegion=None):
-        print("Renaming object {} to {} in bucket {}".format(current,newObject,bucketName))
-        s3 = AwsHelper().getResource('s3', awsRegion)
-        s3.Object(bucketName, newObject).copy_from(CopySource=bucketName+"/"+current)
-        s3.Object(bucketName,current).delete()
+        s3client = AwsHelper().getClient('s3', awsRegion)
+        s3client.copy_object(Bucket=bucketName, Key=newObject, CopySource={'Bucket': bucketName, 'Key': current})
+        s3client.delete_object(Bucket=bucketName, Key=current)
+        instrumentation.count("S3CopyObject")
+        instrumentation.count("S3DeleteObject")
+
+# Lazy listing of the keys under a prefix. Keys are yielded as each page arrives, so a caller can stop
+# early without listing the rest of the prefix. With a delimiter, keys in sub folders are skipped by S3.
+# After stopping, continuationToken is a watermark (the last key read) that resumes the scan in a later
+# invocation with S3KeyListing(..., continuationToken=token); it is None once the prefix is exhausted.
+# With withSize, (key, size in bytes) tuples are yielded instead of keys.
+class S3KeyListing:
+
+    def __init__(self, bucketName, prefix, extensions=None, continuationToken=None, delimiter=None,
+                 pageSize=1000, awsRegion=None, withSize=False):
+        self.bucketName = bucketName
+        self.prefix = prefix
+        self.extensions = extensions
+        self.delimiter = delimiter
+        self.pageSize = pageSize
+        self.awsRegion = awsRegion
+        self.withSize = withSize
+        self.lastKey = continuationToken
+        self.exhausted = False
+
+    @property
+    def continuationToken(self):
+        return None if self.exhausted else self.lastKey
+
+    def __iter__(self):
+        s3client = AwsHelper().getClient('s3', self.awsRegion)
+        request = dict(Bucket=self.bucketName, Prefix=self.prefix, MaxKeys=self.pageSize)
+        if self.delimiter:
+            request['Delimiter'] = self.delimiter
+        if self.lastKey:
+            request['StartAfter'] = self.lastKey
+        while True:
+            response = s3client.list_objects_v2(**request)
+            instrumentation.count("S3ListObjects")
+            for doc in response.get('Contents', []):
+                docName = doc['Key']
+                self.lastKey = docName
+                if self.extensions is None or FileHelper.getFileExtenstion(docName).lower() in self.extensions:
+                    yield (docName, doc['Size']) if self.withSize else docName
+            if not response.get('IsTruncated'):
+                self.exhausted = True
+                return
+            request.pop('StartAfter', None)
+            request['ContinuationToken'] = response['NextContinuationToken']
 
 class FileHelper:
     @staticmethod
@@ -0,0 +1,102 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Stage timers and counters of one invocation, written at the end of the invocation as a single line in the
+# CloudWatch Embedded Metric Format. Timers of stages that run on worker threads are summed over the threads.
+DEFAULT_METRICS_NAMESPACE = "TranslateCaptions"
+
+_lock = threading.Lock()
+_timers = {}
+_counters = {}
+
+
+# Level of the handler loggers, LOG_LEVEL (DEBUG, INFO, WARNING, ERROR), INFO when unset or unknown
+def logLevel():
+    level = logging.getLevelName(os.environ.get("LOG_LEVEL", "INFO").strip().upper())
+    return level if isinstance(level, int) else logging.INFO
+
+
+# Caption bodies (delimited documents, translated files) are only logged when LOG_CAPTION_BODIES is true
+# and the level is DEBUG, they cost seconds and megabytes of log ingestion on large files
+def logBodies(logger):
+    return os.environ.get("LOG_CAPTION_BODIES", "false").strip().lower() == "true" and logger.isEnabledFor(logging.DEBUG)
+
+
+def getLogger(name):
+    logging.basicConfig(level=logLevel())
+    logger = logging.getLogger(name)
+    logger.setLevel(logLevel())
+    return logger
+
+
+def count(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def addTime(stage, seconds):
+    with _lock:
+        _timers[stage] = _timers.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timer(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        addTime(stage, time.perf_counter() - started)
+
+
+# Wrap function to add its run time to stage, for work handed to an executor
+def timed(stage, function):
+    def call(*args, **kwargs):
+        with timer(stage):
+            return function(*args, **kwargs)
+    return call
+
+
+def reset():
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+# Return the stage timers (seconds) and counters collected so far and start over
+def drain():
+    with _lock:
+        timers = dict(_timers)
+        counters = dict(_counters)
+        _timers.clear()
+        _counters.clear()
+    return timers, counters
+
+
+# Return the metrics of the invocation as an EMF document ({stage}Time in milliseconds, counters as Count or
+# Bytes) and start over. Nothing is written when METRICS_NAMESPACE is set to an empty value.
+def emit(functionName):
+    timers, counters = drain()
+    namespace = os.environ.get("METRICS_NAMESPACE", DEFAULT_METRICS_NAMESPACE)
+    document = {"FunctionName": functionName}
+    definitions = []
+    for stage, seconds in sorted(timers.items()):
+        document["{}Time".format(stage)] = round(seconds * 1000, 3)
+        definitions.append({"Name": "{}Time".format(stage), "Unit": "Milliseconds"})
+    for name, value in sorted(counters.items()):
+        document[name] = value
+        definitions.append({"Name": name, "Unit": "Bytes" if name.endswith("Bytes") else "Count"})
+    document["_aws"] = {
+        "Timestamp": int(time.time() * 1000),
+        "CloudWatchMetrics": [{"Namespace": namespace, "Dimensions": [["FunctionName"]], "Metrics": definitions}]
+    }
+    if namespace:
+        # EMF documents are picked up from the standard output of the function
+        print(json.dumps(document))
+    return document
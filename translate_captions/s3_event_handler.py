@@ -1,74 +1,439 @@
 ## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 ## SPDX-License-Identifier: MIT-0
 
+import hashlib
+import itertools
 import json
-import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
 from botocore.exceptions import ClientError
-from helper import FileHelper,S3Helper,AwsHelper
-from captions_helper import Captions
+from helper import FileHelper,S3Helper,AwsHelper,S3KeyListing,initClients
+from captions_helper import Captions,batchKey,batchJobsKey,captionLayout
+from caption_track import CaptionTrack
+from translation_memory import createTranslationMemory
+import instrumentation
+
+logger = instrumentation.getLogger(__name__)
+# every batch reads and writes S3 and starts translation jobs
+initClients('s3', 'translate')
+
+DEFAULT_MAX_WORKERS = 8
+# Delimited files larger than this are split at caption boundaries into shards that are translated as separate documents
+DEFAULT_SHARD_MAX_BYTES = 1000000
+# Total size of the documents of one batch job, the staged files are spread over as many jobs as needed
+DEFAULT_JOB_MAX_BYTES = 500000000
+JOB_MAX_DOCUMENTS = 1000000
+# Segment modes, how a translated sentence is spread over its captions
+SEGMENT_WEIGHTINGS = ("length", "timing")
+# Stop taking new files this many seconds before the Lambda timeout and continue in a new invocation
+DEADLINE_MARGIN_SECONDS = 60
+CAPTION_EXTENSIONS = ["vtt", "srt"]
+# One marker per uploaded object version taken by a batch, duplicate deliveries of an upload event are skipped
+PROCESSED_MARKER_PREFIX = "captions-processed/"
+# Batches with jobs over the Amazon Translate concurrent job limit, started by a later scheduled invocation
+PENDING_BATCH_PREFIX = "captions-pending/"
+
+# Convert one VTT or SRT file: read, parse, delimit and write it to captions-in/ (or translate it right
+# away when it is short). Returns the outcome of the file, sources are renamed in bulk afterwards.
+def processFile(captions, request, obj):
+    bucketName = request["bucketName"]
+    sourceLanguageCode = request["sourceLanguage"]
+    targetLanguageCodes = request["targetLanguages"]
+    realtimeThreshold = int(request.get("realtime_threshold", 0))
+    batchId = request.get("batch_id")
+    outcome = {"Key": obj}
+    try:
+        vttObject = {}
+        vttObject["Bucket"] = bucketName
+        vttObject["Key"] = obj
+        captions_list = CaptionTrack()
+        #based on the file type call the method that coverts them into a caption track
+        if(obj.endswith("vtt")):
+            captions_list =  captions.vttToCaptions(vttObject)
+        elif(obj.endswith("srt")):
+            captions_list =  captions.srtToCaptions(vttObject)
+        instrumentation.count("Cues", len(captions_list))
+        fileName = obj.split("/")[-1]
+        #in segment mode consecutive captions are merged into sentences, translated as one span and spread back
+        #over the captions by source length or duration
+        segmentMode = request.get("segment_mode", "off")
+        segmentWeighting = segmentMode if segmentMode in SEGMENT_WEIGHTINGS else None
+        #captions found in the translation memory or unchanged since the previous upload of the file, for every
+        #target language, are left out of the delimited file; they take the timing of the new upload
+        with instrumentation.timer("Lookup"):
+            hashes = captions.captionHashes(captions_list)
+            knownCaptions = captions.combineCachedCaptions(
+                captions.lookupCachedCaptions(captions_list,sourceLanguageCode,targetLanguageCodes,segmentWeighting=segmentWeighting),
+                captions.lookupRevisionCaptions(bucketName,fileName,hashes,sourceLanguageCode,targetLanguageCodes))
+            cachedCaptions = captions.commonCachedCaptions(knownCaptions,targetLanguageCodes)
+        cachedIndexes = next(iter(cachedCaptions.values())) if cachedCaptions else None
+        with instrumentation.timer("Delimit"):
+            segments = captions.SegmentCaptions(captions_list,cachedIndexes) if segmentWeighting else None
+            #convert the text captions in the list object to a delimited file, inline tags are sent as placeholders
+            tags = {}
+            delimitedFile = captions.ConvertToDemilitedFiles(captions_list,cachedIndexes,segments,tags)
+            delimitedBytes = len(delimitedFile.encode('utf-8'))
+        unchanged = cachedIndexes is not None and len(cachedIndexes) == len(captions_list)
+        #short caption files, and files with nothing left to translate, are translated synchronously and written
+        #straight to the output folder. Each language only translates the captions it has no translation for.
+        if unchanged or delimitedBytes <= realtimeThreshold:
+            for targetLanguageCode in targetLanguageCodes:
+                with instrumentation.timer("Translate"):
+                    translatedCaptions = captions.TranslateCaptionsRealtime(captions_list,sourceLanguageCode,targetLanguageCode,
+                                                                            cachedCaptions=knownCaptions.get(targetLanguageCode, {}),
+                                                                            segmentWeighting=segmentWeighting)
+                storeRevision = lambda track: captions.storeRevision(bucketName,fileName,hashes,track,sourceLanguageCode,targetLanguageCode)
+                translatedText, _ = captions.FinishTranslatedCaptions(translatedCaptions,"vtt" if obj.endswith("vtt") else "srt",
+                                                                      captionLayout(request),storeRevision)
+                newObjectKey = "output/{}.{}".format(targetLanguageCode,fileName)
+                with instrumentation.timer("Upload"):
+                    S3Helper().writeToS3(translatedText,bucketName,newObjectKey)
+                logger.debug("Output Object: {}/{}".format(bucketName, newObjectKey))
+            outcome["Status"] = "translated"
+            return outcome
+        instrumentation.count("DelimitedBytes", delimitedBytes)
+        shardMaxBytes = int(request.get("shard_max_bytes", DEFAULT_SHARD_MAX_BYTES))
+        with instrumentation.timer("Upload"):
+            if delimitedBytes > shardMaxBytes:
+                #large files are split into shards, the manifest tells the job completion how many shards to stitch back
+                shards = captions.ShardDelimitedFile(delimitedFile,shardMaxBytes)
+                manifest = {"submission": str(int(round(time.time() * 1000))), "shards": len(shards)}
+                for shard, shardContent in enumerate(shards):
+                    S3Helper().writeToS3(shardContent,bucketName,batchKey("captions-in",batchId,"{}.shard{:04d}.delimited".format(fileName, shard)))
+                S3Helper().writeToS3(json.dumps(manifest),bucketName,batchKey("captions-timing",batchId,"{}.shards.json".format(fileName)))
+                newObjectKey = batchKey("captions-in",batchId,"{}.shard*.delimited".format(fileName))
+            else:
+                newObjectKey = batchKey("captions-in",batchId,"{}.delimited".format(fileName))
+                S3Helper().writeToS3(str(delimitedFile),bucketName,newObjectKey)
+            #the cue timing is kept next to the delimited file so the job completion does not re-parse the source
+            S3Helper().writeToS3(captions_list.timingIndex(),bucketName,batchKey("captions-timing",batchId,"{}.timing".format(fileName)))
+            S3Helper().writeToS3(captions.packCaptionHashes(hashes),bucketName,batchKey("captions-timing",batchId,"{}.hashes".format(fileName)))
+            #the job completion only has the cue timing, the source lengths are kept to spread the segments. Always
+            #written so a segmented earlier upload of the same file is not read as segmented.
+            segmentInfo = {"weighting": segmentWeighting}
+            if segmentWeighting == "length":
+                segmentInfo["lengths"] = captions.segmentWeights(captions_list,segmentWeighting)
+            S3Helper().writeToS3(json.dumps(segmentInfo),bucketName,batchKey("captions-timing",batchId,"{}.segments".format(fileName)))
+            #the VTT header, blocks, cue identifiers and settings and the inline tags of the spans, written back by the job completion
+            formatInfo = captions_list.formatInfo()
+            if formatInfo or tags:
+                S3Helper().writeToS3(json.dumps({"track": formatInfo, "tags": tags}),bucketName,batchKey("captions-timing",batchId,"{}.format".format(fileName)))
+            #always written, a leftover from an earlier upload of the same file must not be merged into this one
+            S3Helper().writeToS3(json.dumps(cachedCaptions),bucketName,batchKey("captions-tm",batchId,"{}.json".format(fileName)))
+            #the text sent for translation, used to re-request misaligned captions and to fill the translation memory
+            S3Helper().writeToS3(str(delimitedFile),bucketName,batchKey("captions-tm",batchId,"{}.source".format(fileName)))
+        output = "Output Object: {}/{}".format(bucketName, newObjectKey)
+        logger.debug(output)
+        outcome["Status"] = "submitted"
+    except ClientError as e:
+        logger.error("An error occured with S3 Bucket Operation on {}: {}".format(obj, e))
+        outcome["Status"] = "failed"
+        outcome["Error"] = str(e)
+    except Exception as e:
+        logger.exception("Error occured processing the captions file {}".format(obj))
+        outcome["Status"] = "failed"
+        outcome["Error"] = str(e)
+    return outcome
+
+# Spread the delimited files staged in captions-in/<batch id>/ over batch jobs of at most job_max_bytes. A batch
+# that fits in one job is translated from its staging folder, otherwise the files of each job are moved under
+# their own captions-in/<batch id>-<part>/ prefix. The jobs are started concurrently, the ids of the jobs that
+# started are added to started. Returns the translation contexts of the jobs left over the concurrent job limit.
+def startTranslationJobs(captions, request, translateContext, maxWorkers, started):
+    bucketName = translateContext["bucket"]
+    batchId = request["batch_id"]
+    jobMaxBytes = int(request.get("job_max_bytes", DEFAULT_JOB_MAX_BYTES))
+    stagingPrefix = batchKey("captions-in",batchId,"")
+    parts = []
+    partBytes = 0
+    for key, size in S3KeyListing(bucketName,stagingPrefix,["delimited"],delimiter="/",withSize=True):
+        if not parts or (parts[-1] and (partBytes + size > jobMaxBytes or len(parts[-1]) >= JOB_MAX_DOCUMENTS)):
+            parts.append([])
+            partBytes = 0
+        parts[-1].append((key, size))
+        partBytes += size
+    moves = []
+    contexts = []
+    for part, keys in enumerate(parts):
+        partPrefix = stagingPrefix
+        if len(parts) > 1:
+            partPrefix = "captions-in/{}-{:04d}/".format(batchId, part)
+            moves.extend((key, partPrefix + key.split("/")[-1], size) for key, size in keys)
+        partContext = dict(translateContext)
+        partContext["inputLocation"] = partPrefix
+        partContext["jobPrefix"] = "{}-p{:04d}-".format(translateContext["jobPrefix"], part)
+        contexts.append(partContext)
+    logger.info("Starting {} translation jobs for {} files of batch {}".format(len(contexts), sum(map(len, parts)), batchId))
+    with instrumentation.timer("StartJobs"):
+        for key, error in S3Helper().moveObjects(bucketName,moves,maxWorkers):
+            logger.error("An error occured moving {} to its job folder: {}".format(key, error))
+        with ThreadPoolExecutor(max_workers=max(1, len(contexts))) as executor:
+            return list(filter(None, executor.map(lambda context: startJobs(captions, context, started), contexts)))
+
+# Start the jobs of one translation context. Returns the context of the target languages left over the concurrent
+# job limit, or None when every job started.
+def startJobs(captions, context, started):
+    pending = []
+    captions.TranslateCaptions(context, [], started, pending)
+    if not pending:
+        return None
+    pendingContext = dict(context)
+    pendingContext["targetLangList"] = pending
+    return pendingContext
+
+def pendingBatchKey(batchId):
+    return "{}{}.json".format(PENDING_BATCH_PREFIX, batchId)
+
+# Record the jobs of a batch for the job completions, which remove the intermediate files of the batch once every
+# listed job is done and no job is pending. The contexts of the pending jobs are kept under captions-pending/.
+def recordBatchJobs(bucketName, batchId, started, pending):
+    if started or pending:
+        S3Helper().writeToS3(json.dumps({"jobs": started, "pending": len(pending) > 0}),bucketName,batchJobsKey(batchId))
+    if pending:
+        S3Helper().writeToS3(json.dumps({"batchId": batchId, "contexts": pending}),bucketName,pendingBatchKey(batchId))
+        instrumentation.count("PendingJobs", len(pending))
+
+# Start the jobs of the batches left over the concurrent job limit, oldest batch first (batch ids start with the
+# submission time). Once a job is over the limit again the remaining jobs wait for the next scheduled run.
+def startPendingBatches(request):
+    bucketName = request["bucketName"]
+    captions = Captions()
+    for key in S3KeyListing(bucketName,PENDING_BATCH_PREFIX,["json"]):
+        record = json.loads(S3Helper().readFromS3(bucketName,key))
+        batchId = record["batchId"]
+        started = []
+        pending = []
+        for context in record["contexts"]:
+            pendingContext = startJobs(captions, context, started) if not pending else context
+            if pendingContext is not None:
+                pending.append(pendingContext)
+        jobs = json.loads(S3Helper().readFromS3(bucketName,batchJobsKey(batchId)))["jobs"]
+        recordBatchJobs(bucketName, batchId, jobs + started, pending)
+        logger.info("Started {} pending translation jobs of batch {}, {} still pending".format(len(started), batchId, len(pending)))
+        if pending:
+            return
+        S3Helper().deleteObject(bucketName,key)
+
+# Marker key of an uploaded object version, the sequencer of the event identifies the upload and is the same
+# on every delivery of its event
+def processedMarkerKey(key, sequencer):
+    return "{}{}".format(PROCESSED_MARKER_PREFIX, hashlib.sha1("{}:{}".format(key, sequencer).encode("utf-8")).hexdigest())
+
+# Take the uploads of the event for this batch, the keys taken are added to claimed. An upload is skipped when an
+# earlier delivery of its event is done with it. An upload claimed by an invocation that did not finish (Lambda
+# timeout, crash, unhandled error) still has its source in input/ and is taken again.
+def claimUploads(request, claimed):
+    bucketName = request["bucketName"]
+    for key, sequencer in request["uploads"]:
+        markerKey = processedMarkerKey(key, sequencer)
+        marker = json.dumps({"key": key, "sequencer": sequencer, "batch": request["batch_id"], "state": "claimed"})
+        if not S3Helper().createObject(marker,bucketName,markerKey):
+            if json.loads(S3Helper().readFromS3(bucketName,markerKey)).get("state") == "done" or not S3Helper().objectExists(bucketName,key):
+                logger.info("Upload {} ({}) was already processed, skipping the duplicate event".format(key, sequencer))
+                instrumentation.count("DuplicateUploads")
+                continue
+            logger.info("Upload {} ({}) was claimed by an invocation that did not finish, processing it again".format(key, sequencer))
+            instrumentation.count("RetriedUploads")
+            S3Helper().writeToS3(marker,bucketName,markerKey)
+        claimed.append(key)
+    return claimed
+
+# Mark the uploads of keys done, a new delivery of their events skips them
+def completeUploads(request, keys):
+    for key, sequencer in request["uploads"]:
+        if key in keys:
+            marker = json.dumps({"key": key, "sequencer": sequencer, "batch": request["batch_id"], "state": "done"})
+            S3Helper().writeToS3(marker,request["bucketName"],processedMarkerKey(key, sequencer))
+
+# Release the uploads of keys, a new delivery of their events processes them again
+def releaseUploads(request, keys):
+    markers = [processedMarkerKey(key, sequencer) for key, sequencer in request["uploads"] if key in keys]
+    for key, error in S3Helper().deleteObjects(request["bucketName"],markers):
+        logger.error("An error occured releasing {}: {}".format(key, error))
+
+# Hand a failed batch back to Lambda: the uploads are released so the retried event processes them again, and
+# the files staged by this invocation are removed when no job of the batch started. Follow-up invocations of a
+# scan keep the files staged by the earlier ones, the retry of the invocation stages the rest of the batch again
+# under the same batch id.
+def releaseBatch(request, claimed, started):
+    bucketName = request["bucketName"]
+    batchId = request["batch_id"]
+    if request.get("uploads") is not None:
+        releaseUploads(request, claimed)
+    if started or request.get("continuation_token") is not None:
+        return
+    #the prefix without a trailing slash also covers the job folders captions-in/<batch id>-<part>/
+    staged = itertools.chain(S3Helper().iterFileNames(bucketName,"captions-in/{}".format(batchId)),
+                             S3Helper().iterFileNames(bucketName,batchKey("captions-timing",batchId,"")),
+                             S3Helper().iterFileNames(bucketName,batchKey("captions-tm",batchId,"")))
+    for key, error in S3Helper().deleteObjects(bucketName,staged):
+        logger.error("An error occured removing the staged file {}: {}".format(key, error))
 
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
 def processRequest(request):
-    output = ""
     logger.info("request: {}".format(request))
 
     bucketName = request["bucketName"]
-    sourceLanguageCode = request["sourceLanguage"]
-    targetLanguageCode = request["targetLanguage"]
-    access_role = request["access_role"]
     triggerFile = request["trigger_file"]
+    batchId = request["batch_id"]
+    maxWorkers = max(1, int(request.get("max_workers", DEFAULT_MAX_WORKERS)))
+    deadline = request.get("deadline")
+    outcomes = []
+    claimed = []
+    continuationToken = None
     try:
-        captions = Captions()
-        #filter only the VTT and SRT file for processing in the input folder
-        objs = S3Helper().getFilteredFileNames(bucketName,"input/",["vtt","srt"])
-        for obj in objs:
-            try:
-                vttObject = {}
-                vttObject["Bucket"] = bucketName
-                vttObject["Key"] = obj
-                captions_list =[]
-                #based on the file type call the method that coverts them into python list object
-                if(obj.endswith("vtt")):
-                    captions_list =  captions.vttToCaptions(vttObject)
-                elif(obj.endswith("srt")):
-                    captions_list =  captions.srtToCaptions(vttObject)
-                #convert the text captions in the list object to a delimited file
-                delimitedFile = captions.ConvertToDemilitedFiles(captions_list)
-                fileName = obj.split("/")[-1]
-                newObjectKey = "captions-in/{}.delimited".format(fileName)
-                S3Helper().writeToS3(str(delimitedFile),bucketName,newObjectKey)   
-                output = "Output Object: {}/{}".format(bucketName, newObjectKey)
-                logger.debug(output)
-                S3Helper().renameObject(bucketName,obj,"{}.processed".format(obj))
-            except ClientError as e:
-                logger.error("An error occured starting the Translate Batch Job: %s" % e)
+        captions = Captions(createTranslationMemory(request.get("translation_memory"), bucketName))
+        listing = None
+        if request.get("uploads") is not None:
+            #the caption files uploaded in the event, all of them are processed in this invocation. An invocation
+            #cut short by the Lambda timeout leaves them claimed and the retried event takes them again.
+            objs = iter(claimUploads(request, claimed))
+            deadline = None
+        else:
+            #filter only the VTT and SRT file for processing in the input folder, keys are listed lazily and a scan
+            #cut short by the deadline resumes after the last listed key in a follow-up invocation
+            listing = S3KeyListing(bucketName,"input/",CAPTION_EXTENSIONS,request.get("continuation_token"),delimiter="/")
+            objs = iter(listing)
+        #files are converted concurrently, the wall time scales with the worker count rather than the file count
+        with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+            while True:
+                chunk = list(itertools.islice(objs, maxWorkers * 4))
+                if not chunk:
+                    break
+                outcomes.extend(executor.map(lambda obj: processFile(captions, request, obj), chunk))
+                if deadline is not None and time.time() > deadline:
+                    break
+        if listing is not None:
+            continuationToken = listing.continuationToken
+        for outcome in outcomes:
+            logger.info("File outcome: {}".format(outcome))
+            instrumentation.count("{}Files".format(outcome["Status"].capitalize()))
         translateContext = {}
-        translateContext["sourceLang"] = sourceLanguageCode
-        translateContext["targetLangList"] = [targetLanguageCode]
-        translateContext["roleArn"] = access_role 
+        translateContext["sourceLang"] = request["sourceLanguage"]
+        translateContext["targetLangList"] = request["targetLanguages"]
+        translateContext["roleArn"] = request["access_role"]
         translateContext["bucket"] = bucketName
-        translateContext["inputLocation"] = "captions-in/"
+        translateContext["inputLocation"] = batchKey("captions-in",batchId,"")
         translateContext["outputlocation"] = "captions-out/"
-        translateContext["jobPrefix"] = "TranslateJob-captions"
-        #Call Amazon Translate to translate the delimited files in the captions-in folder
-        jobinfo = captions.TranslateCaptions(translateContext)
-        S3Helper().deleteObject(bucketName,"input/{}".format(triggerFile))
-        logger.debug(jobinfo)
+        #the batch id in the job name tells the job completion where the files of the batch are
+        translateContext["jobPrefix"] = "TranslateJob-captions-{}".format(batchId)
+        if captions.translationMemory is not None:
+            captions.translationMemory.flush()
+            logger.info("Translation memory: {}".format(captions.translationMemory.stats()))
     except ClientError as e:
+        #the batch is released and Lambda retries the event
         logger.error("An error occured with S3 Bucket Operation: %s" % e)
+        releaseBatch(request, claimed, [])
+        raise e
+    #the batch job is started once the whole input folder has been converted, and before the sources are renamed.
+    #Jobs over the concurrent job limit are left pending with the batch staged, a batch that cannot be started for
+    #any other reason fails the invocation and Lambda retries the event with the sources in place.
+    if continuationToken is None and (request.get("batch_files") or any(outcome["Status"] == "submitted" for outcome in outcomes)):
+        started = []
+        pending = []
+        try:
+            #Call Amazon Translate to translate the delimited files of the batch into every target language
+            pending = startTranslationJobs(captions, request, translateContext, maxWorkers, started)
+        except Exception as e:
+            logger.error("The translation jobs of batch {} could not be started ({} started): {}".format(batchId, len(started), e))
+            releaseBatch(request, claimed, started)
+            raise e
+        finally:
+            recordBatchJobs(bucketName, batchId, started, pending)
+        if pending:
+            logger.warning("{} translation jobs of batch {} are over the concurrent job limit, they start in a later invocation".format(len(pending), batchId))
+    try:
+        #rename the converted files to .processed with concurrent copies and a bulk delete
+        moves = [(outcome["Key"], "{}.processed".format(outcome["Key"])) for outcome in outcomes if outcome["Status"] != "failed"]
+        for key, error in S3Helper().moveObjects(bucketName,moves,maxWorkers):
+            logger.error("An error occured renaming {}: {}".format(key, error))
+        #the renamed uploads are done, a failed upload is released and a new delivery of its event can process it again
+        if request.get("uploads") is not None:
+            completeUploads(request, set(key for key, _ in moves))
+            releaseUploads(request, set(outcome["Key"] for outcome in outcomes if outcome["Status"] == "failed"))
+        if continuationToken is not None:
+            logger.info("Input scan continues after {}".format(continuationToken))
+        elif listing is not None:
+            S3Helper().deleteObject(bucketName,"input/{}".format(triggerFile))
+    except ClientError as e:
+        logger.error("An error occured with S3 Bucket Operation: %s" % e)
+    return {"Files": outcomes, "ContinuationToken": continuationToken}
+
+# Id of a new batch: the submission time and a digest of what started it, unique across concurrent invocations
+def newBatchId(seed):
+    return "{}-{}".format(int(round(time.time() * 1000)), hashlib.sha1(seed.encode("utf-8")).hexdigest()[:8])
 
 def lambda_handler(event, context):
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(instrumentation.logLevel())
     logger.info("event: {}".format(event))
+    instrumentation.reset()
     request = {}
-    request["bucketName"] = event['Records'][0]['s3']['bucket']['name']
+    #upload: every caption file is processed from its own upload event. trigger: the whole input/ folder is swept
+    #when the trigger file is uploaded.
+    processingMode = os.environ.get('PROCESSING_MODE', 'upload')
+    request["trigger_file"] = os.environ['TRIGGER_NAME']
+    if event.get("pendingBatches"):
+        #scheduled invocation, starts the jobs that were over the concurrent job limit
+        startPendingBatches({"bucketName": event["bucketName"]})
+        instrumentation.emit(context.function_name if context is not None else "S3CaptionsFileEventProcessor")
+        return {
+            "statusCode": 200,
+            "body": json.dumps('success')
+        }
+    if "continuationToken" in event:
+        #follow-up invocation of a scan that did not finish in time, it adds to the batch of the scan
+        request["bucketName"] = event["bucketName"]
+        request["continuation_token"] = event["continuationToken"]
+        request["batch_files"] = event.get("batchFiles", False)
+        request["batch_id"] = event["batchId"]
+    else:
+        request["bucketName"] = event['Records'][0]['s3']['bucket']['name']
+        uploads = []
+        sweep = False
+        for record in event['Records']:
+            key = unquote_plus(record['s3']['object']['key'])
+            if key == "input/{}".format(request["trigger_file"]):
+                sweep = True
+            elif key.startswith("input/") and "/" not in key[len("input/"):] and FileHelper.getFileExtenstion(key).lower() in CAPTION_EXTENSIONS:
+                uploads.append((key, record['s3']['object'].get('sequencer') or record['s3']['object'].get('eTag', '')))
+        if processingMode == "trigger" and sweep:
+            request["batch_id"] = newBatchId(request["trigger_file"])
+        elif processingMode != "trigger" and uploads:
+            request["uploads"] = uploads
+            request["batch_id"] = newBatchId(json.dumps(uploads))
+        else:
+            logger.info("Nothing to process in {} mode".format(processingMode))
+            return {
+                "statusCode": 200,
+                "body": json.dumps('success')
+            }
     request["sourceLanguage"] = os.environ['SOURCE_LANG_CODE']
-    request["targetLanguage"] = os.environ['TARGET_LANG_CODE']
+    #TARGET_LANG_CODE holds one or more comma separated target languages
+    request["targetLanguages"] = [code.strip() for code in os.environ['TARGET_LANG_CODE'].split(",") if code.strip()]
     request["access_role"] = os.environ['S3_ROLE_ARN']
-    request["trigger_file"] = os.environ['TRIGGER_NAME']
-    processRequest(request)
+    request["realtime_threshold"] = os.environ.get('REALTIME_THRESHOLD_BYTES', '0')
+    request["translation_memory"] = os.environ.get('TRANSLATION_MEMORY', 'none')
+    request["max_workers"] = os.environ.get('MAX_WORKERS', DEFAULT_MAX_WORKERS)
+    request["max_line_length"] = os.environ.get('MAX_LINE_LENGTH', '0')
+    request["max_lines"] = os.environ.get('MAX_CAPTION_LINES', '0')
+    request["max_chars_per_second"] = os.environ.get('MAX_CHARS_PER_SECOND', '0')
+    request["shard_max_bytes"] = os.environ.get('SHARD_MAX_BYTES', DEFAULT_SHARD_MAX_BYTES)
+    request["job_max_bytes"] = os.environ.get('JOB_MAX_BYTES', DEFAULT_JOB_MAX_BYTES)
+    request["segment_mode"] = os.environ.get('SEGMENT_MODE', 'off')
+    if context is not None:
+        request["deadline"] = time.time() + context.get_remaining_time_in_millis() / 1000.0 - DEADLINE_MARGIN_SECONDS
+    result = processRequest(request)
+    if result["ContinuationToken"] is not None:
+        payload = {
+            "bucketName": request["bucketName"],
+            "continuationToken": result["ContinuationToken"],
+            "batchFiles": request.get("batch_files") or any(outcome["Status"] == "submitted" for outcome in result["Files"]),
+            "batchId": request["batch_id"]
+        }
+        AwsHelper().getClient('lambda').invoke(FunctionName=context.invoked_function_arn, InvocationType='Event',
+                                               Payload=json.dumps(payload))
+    instrumentation.emit(context.function_name if context is not None else "S3CaptionsFileEventProcessor")
     return {
         "statusCode": 200,
         "body": json.dumps('success')
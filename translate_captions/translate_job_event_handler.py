@@ -1,88 +1,318 @@
 ## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 ## SPDX-License-Identifier: MIT-0
+import itertools
 import json
-import logging
 import os
-import sys
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from urllib.parse import urlparse
 from botocore.exceptions import ClientError
-from helper import FileHelper,S3Helper,AwsHelper
-from captions_helper import Captions
+from helper import FileHelper,S3Helper,AwsHelper,S3KeyListing,initClients
+from captions_helper import Captions,batchKey,batchJobsKey,batchJobDoneKey,captionLayout
+from caption_track import CaptionTrack
+from caption_alignment import decodeCaptions
+from caption_segments import segmentsFromStarts
+from translation_memory import createTranslationMemory
+import instrumentation
 
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+logger = instrumentation.getLogger(__name__)
+# every completed job is described and its output read from S3
+initClients('s3', 'translate')
+
+DEFAULT_MAX_WORKERS = 8
+# Translated shard of a large caption file, <file>.shard<NNNN>
+SHARD_PATTERN = re.compile(r"^(.*)\.shard(\d{4})$")
+# Name of a job of a batch, TranslateJob-captions-<batch id>-p<part>-...
+JOB_NAME_PATTERN = re.compile(r"^(TranslateJob-captions-(.+)-p)\d{4}-")
+
+# Load the cue timing of a translated file from the timing index written at submit time, the
+# translations that were not sent to Amazon Translate, the caption content hashes, the segment mode and the
+# inline tags of the spans. Jobs submitted without a timing index re-parse the source file.
+def loadSourceCaptions(captions, bucketName, sourceFileName, batchId=None):
+    tags = {}
+    try:
+        timingIndex = S3Helper().readStreamFromS3(bucketName,batchKey("captions-timing",batchId,"{}.timing".format(sourceFileName))).read()
+        captions_list = CaptionTrack.fromTimingIndex(timingIndex)
+        #the VTT attributes of the track and the inline tags, only written for files that have some
+        try:
+            formatInfo = json.loads(S3Helper().readFromS3(bucketName,batchKey("captions-timing",batchId,"{}.format".format(sourceFileName))))
+            captions_list.applyFormat(formatInfo["track"])
+            tags = dict((int(index), spanTags) for index, spanTags in formatInfo["tags"].items())
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise e
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise e
+        captions_list = parseSourceCaptions(captions, bucketName, sourceFileName)
+    #translations taken from the translation memory or the previous upload when the job was submitted, and the
+    #text that was sent, {index: text}, used to re-request misaligned captions
+    cachedCaptions = readCachedCaptions(bucketName,sourceFileName,batchId)
+    sourceCaptions = {}
+    try:
+        sourceCaptions = decodeCaptions(S3Helper().readFromS3(bucketName,batchKey("captions-tm",batchId,"{}.source".format(sourceFileName))),tags=tags)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise e
+    #content hashes of the source captions, kept with the translations for the next upload of the file
+    try:
+        hashes = captions.unpackCaptionHashes(S3Helper().readStreamFromS3(bucketName,batchKey("captions-timing",batchId,"{}.hashes".format(sourceFileName))).read())
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise e
+        hashes = None
+    #how the segments of a file submitted in segment mode are spread back over their captions
+    segmentInfo = None
+    try:
+        segmentInfo = json.loads(S3Helper().readFromS3(bucketName,batchKey("captions-timing",batchId,"{}.segments".format(sourceFileName))))
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise e
+    return captions_list, cachedCaptions, sourceCaptions, hashes, segmentInfo, tags
+
+def parseSourceCaptions(captions, bucketName, sourceFileName):
+    logger.debug("SourceFileKey:{}.processed".format(sourceFileName))
+    soureFileKey = "input/{}.processed".format(sourceFileName)
+    vttObject = {}
+    vttObject["Bucket"] = bucketName
+    vttObject["Key"] = soureFileKey
+    captions_list = CaptionTrack()
+    #Based on the file format, call the right method to load the file as python object
+    if(sourceFileName.endswith("vtt")):
+        captions_list =  captions.vttToCaptions(vttObject)
+    elif(sourceFileName.endswith("srt")):
+        captions_list =  captions.srtToCaptions(vttObject)
+    return captions_list
+
+# Keep the translated shards of a large caption file under captions-shards/<batch id>/<langCode>.<file>/<submission>/
+# until every shard is translated, shards of one file may be spread over several jobs. Returns a loader of the stitched
+# delimited file once the last shard is in, None while shards are missing.
+def collectShards(bucketName, sourceFileName, targetLanguageCode, shardObjs, maxWorkers, batchId=None):
+    manifest = json.loads(S3Helper().readFromS3(bucketName,batchKey("captions-timing",batchId,"{}.shards.json".format(sourceFileName))))
+    shardPrefix = batchKey("captions-shards",batchId,"{}.{}/{}/".format(targetLanguageCode, sourceFileName, manifest["submission"]))
+    copies = [(obj, "{}{:04d}.delimited".format(shardPrefix, shard)) for shard, obj in shardObjs]
+    copied, errors = S3Helper().copyObjects(bucketName,copies,maxWorkers)
+    for key, error in errors:
+        logger.error("An error occured keeping the translated shard {}: {}".format(key, error))
+    shards = set(FileHelper().getFileName(key) for key in S3KeyListing(bucketName,shardPrefix,["delimited"]))
+    missing = [shard for shard in range(manifest["shards"]) if "{:04d}".format(shard) not in shards]
+    if missing:
+        logger.info("Waiting for {} of {} shards of {}.{}".format(len(missing), manifest["shards"], targetLanguageCode, sourceFileName))
+        return None
+    return partial(readShards, bucketName, shardPrefix, manifest["shards"])
+
+# Stitch the translated shards back in caption order
+def readShards(bucketName, shardPrefix, shardCount):
+    return "".join(S3Helper().readFromS3(bucketName,"{}{:04d}.delimited".format(shardPrefix, shard))
+                   for shard in range(shardCount))
+
+# Rebuild the translated caption files of one source file. The source captions and all translated outputs
+# are fetched at the same time on the I/O pool, uploads are handed back to the I/O pool without waiting.
+# translatedObjs holds (output file name, target language, loader of the translated delimited file).
+def reassembleSourceFile(captions, request, bucketName, sourceFileName, translatedObjs, ioExecutor):
+    source = ioExecutor.submit(instrumentation.timed("Fetch", loadSourceCaptions), captions, bucketName, sourceFileName, request.get("batchId"))
+    contents = [(fileName, targetLanguageCode, ioExecutor.submit(instrumentation.timed("Fetch", loader)))
+                for fileName, targetLanguageCode, loader in translatedObjs]
+    try:
+        captions_list, cachedCaptions, sourceCaptions, hashes, segmentInfo, tags = source.result()
+    except ClientError as e:
+        logger.error("An error occured with S3 bucket operations: %s" % e)
+        return []
+    except Exception:
+        logger.exception("Error occured loading the source captions of {}".format(sourceFileName))
+        return []
+    uploads = []
+    for fileName, targetLanguageCode, content in contents:
+        try:
+            #Read the Delimited file contents
+            content = content.result()
+            # Replace the text captions with the translated content
+            languageCachedCaptions = cachedCaptions.get(targetLanguageCode) or {}
+            recover = None
+            if sourceCaptions and targetLanguageCode is not None:
+                recover = partial(captions.TranslateCaptionIndexes, sourceCaptions, sourceLanguageCode=request["sourceLangCode"],
+                                  targetLanguageCode=targetLanguageCode)
+            #the spans sent are the captions left out of the cache, or in segment mode the segments numbered by
+            #their first caption
+            indexes = [i for i in range(len(captions_list)) if i not in languageCachedCaptions]
+            expected = sorted(sourceCaptions) if sourceCaptions else indexes
+            segments = None
+            weights = None
+            if segmentInfo and segmentInfo.get("weighting"):
+                segments = segmentsFromStarts(expected, indexes)
+                weights = captions.segmentWeights(captions_list, segmentInfo["weighting"], segmentInfo.get("lengths"))
+            #the revision is stored unwrapped, then the captions are split and merged to the line count and reading
+            #speed limits and written in VTT or SRT format
+            storeRevision = lambda track: captions.storeRevision(bucketName,sourceFileName,hashes,track,request["sourceLangCode"],targetLanguageCode)
+            translatedText, cueCount = captions.ReassembleCaptions(captions_list,content,expected,"vtt" if fileName.endswith("vtt") else "srt",
+                                                                   captionLayout(request),sourceCaptions,request["sourceLangCode"],
+                                                                   targetLanguageCode,languageCachedCaptions,recover,segments,weights,
+                                                                   tags,storeRevision)
+            if instrumentation.logBodies(logger):
+                logger.debug(translatedText)
+                logger.debug(content)
+            instrumentation.count("Cues", cueCount)
+            newObjectKey = "output/{}".format(fileName)
+            # Write the VTT or SRT file into the output S3 folder
+            uploads.append((newObjectKey, ioExecutor.submit(instrumentation.timed("Upload", S3Helper().writeToS3), str(translatedText), bucketName, newObjectKey)))
+        except ClientError as e:
+            logger.error("An error occured with S3 bucket operations: %s" % e)
+        except Exception:
+            logger.exception("Error occured processing the captions file {}".format(fileName))
+    return uploads
 
 def processRequest(request):
-    output = ""
     logger.info("request: {}".format(request))
     up = urlparse(request["s3uri"], allow_fragments=False)
-    accountid = request["accountId"]
-    jobid =  request["jobId"]
     bucketName = up.netloc
     objectkey = up.path.lstrip('/')
     basePrefixPath = objectkey 
-    languageCode = request["langCode"]
+    languageCodes = request["langCodes"]
+    maxWorkers = max(1, int(request.get("max_workers", DEFAULT_MAX_WORKERS)))
     logger.debug("Base Prefix Path:{}".format(basePrefixPath))
-    captions = Captions()
+    captions = Captions(createTranslationMemory(request.get("translation_memory"), bucketName))
     #filter only the delimited files with .delimited suffix
-    objs = S3Helper().getFilteredFileNames(bucketName,basePrefixPath,["delimited"])
+    objs = S3Helper().iterFileNames(bucketName,basePrefixPath,["delimited"])
+    #group the translated files by source file, a job writes one <langCode>.<file>.delimited per target language
+    #and one <langCode>.<file>.shard<NNNN>.delimited per shard of a large file
+    sourceFiles = {}
+    shardedFiles = {}
     for obj in objs:
+        fileName = FileHelper().getFileName(obj)
+        sourceFileName = fileName
+        targetLanguageCode = None
+        for languageCode in languageCodes:
+            if fileName.startswith("{}.".format(languageCode)):
+                sourceFileName = fileName[len(languageCode) + 1:]
+                targetLanguageCode = languageCode
+                break
+        match = SHARD_PATTERN.match(sourceFileName)
+        if match is not None and targetLanguageCode is not None:
+            shardedFiles.setdefault((match.group(1), targetLanguageCode), []).append((int(match.group(2)), obj))
+        else:
+            sourceFiles.setdefault(sourceFileName, []).append((fileName, targetLanguageCode, partial(S3Helper().readFromS3, bucketName, obj)))
+    #sharded files are rebuilt by the job that completes their last shard
+    if shardedFiles:
+        with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+            collected = [(key, executor.submit(collectShards, bucketName, key[0], key[1], shardObjs, maxWorkers, request.get("batchId")))
+                         for key, shardObjs in shardedFiles.items()]
+            for (sourceFileName, targetLanguageCode), loader in collected:
+                try:
+                    loader = loader.result()
+                except ClientError as e:
+                    logger.error("An error occured collecting the shards of {}: {}".format(sourceFileName, e))
+                    continue
+                if loader is not None:
+                    sourceFiles.setdefault(sourceFileName, []).append(("{}.{}".format(targetLanguageCode, sourceFileName), targetLanguageCode, loader))
+    #merge and serialization run on the worker pool while the I/O pool keeps downloading and uploading
+    with ThreadPoolExecutor(max_workers=maxWorkers * 2) as ioExecutor:
+        with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+            reassembled = [executor.submit(reassembleSourceFile, captions, request, bucketName, sourceFileName, translatedObjs, ioExecutor)
+                           for sourceFileName, translatedObjs in sourceFiles.items()]
+            for uploads in reassembled:
+                for newObjectKey, upload in uploads.result():
+                    try:
+                        upload.result()
+                        instrumentation.count("TranslatedFiles")
+                        logger.debug("Output Object: {}/{}".format(bucketName, newObjectKey))
+                    except ClientError as e:
+                        logger.error("An error occured with S3 bucket operations: %s" % e)
+    if captions.translationMemory is not None:
+        captions.translationMemory.flush()
+        logger.info("Translation memory: {}".format(captions.translationMemory.stats()))
+    finishJob(request, bucketName)
+
+# Record that the job is done and remove the intermediate files. The input folder of the job is always removed, the
+# timing, translation memory and shard files are shared by the jobs of a batch and are only removed once every job
+# of the batch is done.
+def finishJob(request, bucketName):
+    batchId = request.get("batchId")
+    if batchId:
+        S3Helper().writeToS3("",bucketName,batchJobDoneKey(batchId, request["jobId"]))
+    if( request["delete_captionsin"] and request["delete_captionsin"] == "true") :
+        inputPrefix = urlparse(request["inputUri"], allow_fragments=False).path.lstrip('/')
+        objs = S3Helper().iterFileNames(bucketName,inputPrefix,["delimited"])
+        if batchId and batchJobsDone(bucketName, batchId, request["jobId"], request["batchJobPrefix"]):
+            objs = itertools.chain(objs,
+                                   S3Helper().iterFileNames(bucketName,batchKey("captions-tm",batchId,"")),
+                                   S3Helper().iterFileNames(bucketName,batchKey("captions-timing",batchId,"")),
+                                   S3Helper().iterFileNames(bucketName,batchKey("captions-shards",batchId,"")))
+        elif not batchId and not otherJobsPending(request["jobId"]):
+            #jobs started before batches had ids share the top of the folders
+            objs = itertools.chain(objs,
+                                   S3KeyListing(bucketName,"captions-tm/",["json","source"],delimiter="/"),
+                                   S3KeyListing(bucketName,"captions-timing/",["timing","hashes","json","segments"],delimiter="/"),
+                                   (key for key in S3Helper().iterFileNames(bucketName,"captions-shards/",["delimited"]) if key.count("/") == 3))
+        logger.debug("Deleting temp delimited caption files")
         try:
-            #Read the Delimited file contents
-            content = S3Helper().readFromS3(bucketName,obj)
-            fileName = FileHelper().getFileName(obj)
-            sourceFileName = FileHelper().getFileName(obj.replace("{}.".format(languageCode),"",1))
-            logger.debug("SourceFileKey:{}.processed".format(sourceFileName))
-            soureFileKey = "input/{}.processed".format(sourceFileName)
-            vttObject = {}
-            vttObject["Bucket"] = bucketName
-            vttObject["Key"] = soureFileKey
-            captions_list = []
-            #Based on the file format, call the right method to load the file as python object
-            if(fileName.endswith("vtt")):
-                    captions_list =  captions.vttToCaptions(vttObject)
-            elif(fileName.endswith("srt")):
-                captions_list =  captions.srtToCaptions(vttObject)
-            # Replace the text captions with the translated content
-            translatedCaptionsList = captions.DelimitedToWebCaptions(captions_list,content,"<span>",15)
-            translatedText = ""
-            # Recreate the Caption files in VTT or SRT format
-            if(fileName.endswith("vtt")):
-                translatedText =  captions.captionsToVTT(translatedCaptionsList)
-            elif(fileName.endswith("srt")):
-                translatedText =  captions.captionsToSRT(translatedCaptionsList)
-            logger.debug(translatedText)
-            logger.debug(content)
-            newObjectKey = "output/{}".format(fileName)
-            # Write the VTT or SRT file into the output S3 folder
-            S3Helper().writeToS3(str(translatedText),bucketName,newObjectKey)   
-            output = "Output Object: {}/{}".format(bucketName, newObjectKey)
-            logger.debug(output)
+            for key, error in S3Helper().deleteObjects(bucketName,objs):
+                logger.error("Error occured in deleting the delimited captions file {}: {}".format(key, error))
         except ClientError as e:
             logger.error("An error occured with S3 bucket operations: %s" % e)
-        except :
-            e = sys.exc_info()[0]
-            logger.error("Error occured processing the captions file: %s" % e)
-    objs = S3Helper().getFilteredFileNames(bucketName,"captions-in/",["delimited"])
-    if( request["delete_captionsin"] and request["delete_captionsin"] == "true") :
-        for obj in objs:
-            try:
-                logger.debug("Deleting temp delimited caption files {}".format(obj))
-                S3Helper().deleteObject(bucketName,obj)
-            except ClientError as e:
-                logger.error("An error occured with S3 bucket operations: %s" % e)
-            except :
-                e = sys.exc_info()[0]
-                logger.error("Error occured in deleting the delimited captions file: %s" % e)
 
+# True when every job of the batch has written its done marker and no job is waiting to be started. Batches
+# submitted before the job list was kept fall back on the jobs Amazon Translate still has submitted or in progress.
+def batchJobsDone(bucketName, batchId, jobId, jobNamePrefix):
+    try:
+        record = json.loads(S3Helper().readFromS3(bucketName,batchJobsKey(batchId)))
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise e
+        return not otherJobsPending(jobId, jobNamePrefix)
+    if record.get("pending"):
+        logger.info("Batch {} has jobs waiting to be started, keeping its files".format(batchId))
+        return False
+    jobs = record["jobs"]
+    done = set(FileHelper().getFileName(key) for key in S3KeyListing(bucketName,batchKey("captions-timing",batchId,"jobs/"),["done"]))
+    pending = [job for job in jobs if job not in done]
+    if pending:
+        logger.info("{} of {} jobs of batch {} are not done yet, keeping its files".format(len(pending), len(jobs), batchId))
+    return not pending
+
+# True when a captions job other than jobId whose name starts with jobNamePrefix is submitted or in progress
+def otherJobsPending(jobId, jobNamePrefix="TranslateJob-captions"):
+    translate_client = AwsHelper().getClient('translate')
+    for jobStatus in ("SUBMITTED", "IN_PROGRESS"):
+        kwargs = {"Filter": {"JobStatus": jobStatus}}
+        while True:
+            response = translate_client.list_text_translation_jobs(**kwargs)
+            for job in response.get("TextTranslationJobPropertiesList", []):
+                if job["JobId"] != jobId and job.get("JobName", "").startswith(jobNamePrefix):
+                    return True
+            if not response.get("NextToken"):
+                break
+            kwargs["NextToken"] = response["NextToken"]
+    return False
+
+# Read the translations found in the translation memory at submit time, {targetLanguageCode: {index: text}}
+def readCachedCaptions(bucketName, sourceFileName, batchId=None):
+    try:
+        content = S3Helper().readFromS3(bucketName,batchKey("captions-tm",batchId,"{}.json".format(sourceFileName)))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return {}
+        raise e
+    cachedCaptions = {}
+    for languageCode, entries in json.loads(content).items():
+        cachedCaptions[languageCode] = dict((int(index), text) for index, text in entries.items())
+    return cachedCaptions
 
 def lambda_handler(event, context):
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(instrumentation.logLevel())
     logger.info("event: {}".format(event))
+    instrumentation.reset()
     request = {}
     statusCode = "200"
     message ="success"
     request["delete_captionsin"] = os.environ["DELETE_INTERMEDIATE_FILES"]
+    #an lru memory lives in the containers of the S3 event function, batch translations only fill a shared memory
+    translationMemory = os.environ.get("TRANSLATION_MEMORY", "none")
+    request["translation_memory"] = "none" if translationMemory.strip().lower() == "lru" else translationMemory
+    request["max_workers"] = os.environ.get("MAX_WORKERS", DEFAULT_MAX_WORKERS)
+    request["max_line_length"] = os.environ.get("MAX_LINE_LENGTH", "0")
+    request["max_lines"] = os.environ.get("MAX_CAPTION_LINES", "0")
+    request["max_chars_per_second"] = os.environ.get("MAX_CHARS_PER_SECOND", "0")
     try:
         jobId = event["detail"]["jobId"]
         translate_client = AwsHelper().getClient('translate')
@@ -91,19 +321,35 @@ def lambda_handler(event, context):
         request["s3uri"] =  response['TextTranslationJobProperties']['OutputDataConfig']['S3Uri']
         request["jobId"] = response['TextTranslationJobProperties']['JobId']
         request["jobName"] = response['TextTranslationJobProperties']['JobName']
+        request["inputUri"] = response['TextTranslationJobProperties']['InputDataConfig']['S3Uri']
+        #jobs of a batch keep their intermediate files under the batch id
+        match = JOB_NAME_PATTERN.match(request["jobName"])
+        if match is not None:
+            request["batchJobPrefix"] = match.group(1)
+            request["batchId"] = match.group(2)
         status = response['TextTranslationJobProperties']['JobStatus']
-        request["langCode"] = response['TextTranslationJobProperties']['TargetLanguageCodes'][0]
+        request["langCodes"] = response['TextTranslationJobProperties']['TargetLanguageCodes']
+        request["sourceLangCode"] = response['TextTranslationJobProperties']['SourceLanguageCode']
         request["accountId"] = context.invoked_function_arn.split(":")[4]
         if status == "COMPLETED" and 'TranslateJob-captions' in response['TextTranslationJobProperties']['JobName'] :
+            #time from the submission of the job to its completion
+            submittedTime = response['TextTranslationJobProperties'].get('SubmittedTime')
+            endTime = response['TextTranslationJobProperties'].get('EndTime')
+            if submittedTime is not None and endTime is not None:
+                instrumentation.addTime("TranslateWait", (endTime - submittedTime).total_seconds())
             processRequest(request)
         elif status in ["FAILED", "COMPLETED_WITH_ERROR"]:
             statusCode ="500"
             message = "Translation Job failed"
             logger.warn("Job ID {} failed or completed with errors, exiting".format(request["jobId"]))
+            #a failed job counts as done, the other jobs of its batch can still remove the shared files
+            if 'TranslateJob-captions' in request["jobName"]:
+                finishJob(request, urlparse(request["inputUri"], allow_fragments=False).netloc)
     except ValueError:
         statusCode ="500"
         message = "Error converting the XML document"
         logger.error("Error occured loading the json from event:{}".format(event))
+    instrumentation.emit(context.function_name if context is not None else "TranslateCaptionsJobEventProcessor")
     return {
             "statusCode": statusCode,
             "body": json.dumps(message)
@@ -0,0 +1,254 @@
+## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+## SPDX-License-Identifier: MIT-0
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from helper import AwsHelper
+import instrumentation
+
+logger = instrumentation.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 100000
+# Entries of the S3 store cached per container, entries written at most per flush, concurrent S3 requests
+S3_CACHE_ENTRIES = 50000
+S3_MAX_PENDING_ENTRIES = 10000
+S3_MAX_WORKERS = 32
+
+# Backends are kept for the life of the container so warm invocations reuse them
+_localBackends = {}
+
+
+# Collapse whitespace so that re-wrapped lines still hit the same entry
+def normalizeText(text):
+    return " ".join(text.split())
+
+
+# Key of a translation memory entry: the normalized source text, the language pair and the terminology
+def memoryKey(text, sourceLanguageCode, targetLanguageCode, terminology_name=[]):
+    digest = hashlib.sha1()
+    digest.update("{}\x1f{}\x1f{}\x1f".format(sourceLanguageCode, targetLanguageCode, ",".join(sorted(terminology_name))).encode("utf-8"))
+    digest.update(normalizeText(text).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# In-process store, evicts the least recently used entries beyond maxEntries.
+# Survives across warm invocations of the same Lambda container.
+class LRUBackend:
+
+    def __init__(self, maxEntries=DEFAULT_MAX_ENTRIES):
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def getMany(self, keys):
+        found = {}
+        with self.lock:
+            for key in keys:
+                value = self.entries.get(key)
+                if value is not None:
+                    self.entries.move_to_end(key)
+                    found[key] = value
+        return found
+
+    def putMany(self, items):
+        with self.lock:
+            for key, value in items.items():
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+
+    def flush(self):
+        pass
+
+
+# Local SQLite file store, evicts the least recently used entries beyond maxEntries
+class SQLiteBackend:
+
+    def __init__(self, path, maxEntries=DEFAULT_MAX_ENTRIES):
+        # only loaded by the containers configured with a SQLite memory
+        import sqlite3
+        self.maxEntries = maxEntries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS memory (key TEXT PRIMARY KEY, value TEXT, used INTEGER)")
+        self.clock = self.connection.execute("SELECT COALESCE(MAX(used), 0) FROM memory").fetchone()[0]
+
+    def getMany(self, keys):
+        found = {}
+        keys = list(keys)
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self.connection.execute(
+                    "SELECT key, value FROM memory WHERE key IN ({})".format(",".join("?" * len(chunk))), chunk)
+                found.update(rows)
+            if found:
+                self.clock += 1
+                self.connection.executemany("UPDATE memory SET used = ? WHERE key = ?", [(self.clock, key) for key in found])
+                self.connection.commit()
+        return found
+
+    def putMany(self, items):
+        with self.lock:
+            self.clock += 1
+            self.connection.executemany("INSERT OR REPLACE INTO memory (key, value, used) VALUES (?, ?, ?)",
+                                        [(key, value, self.clock) for key, value in items.items()])
+            count = self.connection.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+            if count > self.maxEntries:
+                self.connection.execute("DELETE FROM memory WHERE key IN (SELECT key FROM memory ORDER BY used LIMIT ?)",
+                                        (count - self.maxEntries,))
+            self.connection.commit()
+
+    def flush(self):
+        pass
+
+
+# Store shared by both Lambda functions and every concurrent invocation. Each entry is its own object,
+# translation-memory/<first two characters of the key>/<key> holding the translation, so concurrent invocations
+# never overwrite each other's entries. Lookups fetch the entries missing from the cache concurrently on a pool of
+# maxWorkers threads shared by the worker threads of the handler, new entries are written on flush or once
+# maxPendingEntries are waiting. Entries read or written stay in an LRU cache of cacheEntries, the backend is
+# kept for the life of the container so warm invocations reuse it. Any client with get_object / put_object works,
+# which allows a local stand-in for S3.
+class S3Backend:
+
+    def __init__(self, bucketName, prefix="translation-memory/", s3client=None, cacheEntries=S3_CACHE_ENTRIES,
+                 maxPendingEntries=S3_MAX_PENDING_ENTRIES, maxWorkers=S3_MAX_WORKERS):
+        self.bucketName = bucketName
+        self.prefix = prefix
+        self.s3client = s3client
+        self.cache = LRUBackend(cacheEntries)
+        self.maxPendingEntries = maxPendingEntries
+        self.maxWorkers = maxWorkers
+        self.pending = {}
+        self.lock = threading.Lock()
+        self._executor = None
+
+    def client(self):
+        return self.s3client if self.s3client is not None else AwsHelper().getClient('s3')
+
+    def executor(self):
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.maxWorkers)
+            return self._executor
+
+    def objectKey(self, key):
+        return "{}{}/{}".format(self.prefix, key[:2], key)
+
+    def fetch(self, key):
+        try:
+            instrumentation.count("S3GetObject")
+            response = self.client().get_object(Bucket=self.bucketName, Key=self.objectKey(key))
+            return response['Body'].read().decode('utf-8')
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                raise e
+            return None
+
+    def write(self, item):
+        key, value = item
+        instrumentation.count("S3PutObject")
+        self.client().put_object(Bucket=self.bucketName, Key=self.objectKey(key), Body=value.encode('utf-8'))
+
+    def getMany(self, keys):
+        keys = list(keys)
+        found = self.cache.getMany(keys)
+        with self.lock:
+            for key in keys:
+                if key not in found and key in self.pending:
+                    found[key] = self.pending[key]
+        missing = [key for key in keys if key not in found]
+        if missing:
+            fetched = dict((key, value) for key, value in zip(missing, self.executor().map(self.fetch, missing))
+                           if value is not None)
+            self.cache.putMany(fetched)
+            found.update(fetched)
+        return found
+
+    def putMany(self, items):
+        self.cache.putMany(items)
+        with self.lock:
+            self.pending.update(items)
+            full = len(self.pending) >= self.maxPendingEntries
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if pending:
+            logger.debug("Writing {} translation memory entries".format(len(pending)))
+            list(self.executor().map(self.write, pending.items()))
+
+
+# Translation memory in front of Amazon Translate, keeps hit/miss counters for the lookups
+class TranslationMemory:
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # Returns {index: translation} for the texts found in the memory
+    def lookup(self, texts, sourceLanguageCode, targetLanguageCode, terminology_name=[]):
+        keys = {}
+        for i, text in enumerate(texts):
+            if text.strip():
+                keys.setdefault(memoryKey(text, sourceLanguageCode, targetLanguageCode, terminology_name), []).append(i)
+        found = self.backend.getMany(keys.keys())
+        cached = {}
+        for key, value in found.items():
+            for i in keys[key]:
+                cached[i] = value
+        with self.lock:
+            self.hits += len(cached)
+            self.misses += len(texts) - len(cached)
+        return cached
+
+    def store(self, texts, translations, sourceLanguageCode, targetLanguageCode, terminology_name=[]):
+        items = {}
+        for text, translation in zip(texts, translations):
+            if text.strip():
+                items[memoryKey(text, sourceLanguageCode, targetLanguageCode, terminology_name)] = translation
+        if items:
+            self.backend.putMany(items)
+
+    def flush(self):
+        self.backend.flush()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": float(self.hits) / lookups if lookups else 0.0
+        }
+
+
+# Create the translation memory from the TRANSLATION_MEMORY setting:
+# "none" (or empty), "lru", "sqlite:<path>" or "s3" (stored in the caption bucket)
+def createTranslationMemory(config, bucketName=None):
+    config = (config or "none").strip()
+    if config.lower() == "none":
+        return None
+    if config.lower() == "lru":
+        if config not in _localBackends:
+            _localBackends[config] = LRUBackend()
+        return TranslationMemory(_localBackends[config])
+    if config.lower().startswith("sqlite:"):
+        if config not in _localBackends:
+            _localBackends[config] = SQLiteBackend(config[len("sqlite:"):])
+        return TranslationMemory(_localBackends[config])
+    if config.lower() == "s3":
+        key = ("s3", bucketName)
+        if key not in _localBackends:
+            _localBackends[key] = S3Backend(bucketName)
+        return TranslationMemory(_localBackends[key])
+    raise ValueError("Unknown translation memory backend: {}".format(config))